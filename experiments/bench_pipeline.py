@@ -0,0 +1,196 @@
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+import numpy as np
+
+from mwp.problems.problems import PROBLEMS
+from mwp.problems.render import RenderPlan
+from mwp.trees import grammar_to_trees, ValuesSampler
+from mwp.trees.samples import tree_template, tree_leaves
+
+
+# (problem, max_depth, val_range override, n_samples, engine, storage)
+MATRICES = {
+    'quick': [
+        ('jobs', 8, None, 50, 'python', 'dict'),
+        ('jobs', 8, None, 50, 'numpy', 'csr'),
+        ('jobs_nodiv', 8, None, 50, 'numpy', 'csr'),
+    ],
+    'full': [
+        ('jobs', 8, None, 100, 'python', 'dict'),
+        ('jobs', 10, None, 100, 'python', 'dict'),
+        ('jobs', 10, None, 100, 'numpy', 'csr'),
+        ('jobs', 12, None, 100, 'numpy', 'csr'),
+        ('jobs_nodiv', 8, None, 100, 'python', 'dict'),
+        ('jobs_nodiv', 10, None, 100, 'numpy', 'csr'),
+        # synthetic larger ranges on the jobs grammar
+        ('jobs', 8, (2, 500), 100, 'numpy', 'csr'),
+        ('jobs', 8, (2, 2000), 100, 'numpy', 'csr'),
+    ]
+}
+
+
+def config_name(problem_name, max_depth, val_range, n_samples, engine, storage):
+    name = f'{problem_name}-d{max_depth}'
+    if val_range is not None:
+        name += f'-r{val_range[0]}_{val_range[1]}'
+    return f'{name}-n{n_samples}-{engine}-{storage}'
+
+
+def run_stage(stage, fn, track_memory):
+    '''
+    Time fn, and record its peak traced allocation when track_memory is set.
+    '''
+    if track_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    result, extra = fn()
+    seconds = time.perf_counter() - start
+
+    record = {'stage': stage, 'seconds': seconds, **extra}
+
+    if track_memory:
+        record['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    if 'items' in record:
+        record['items_per_sec'] = record['items'] / seconds if seconds > 0 else None
+
+    return result, record
+
+
+def bench_config(problem_name, max_depth, val_range, n_samples, engine, storage, track_memory=True):
+    _, problem = PROBLEMS[problem_name]()
+    val_range = val_range or problem['val_range']
+
+    random.seed(0)
+    np.random.seed(0)
+
+    records = []
+
+    (exprs, trees), record = run_stage(
+        'grammar_to_trees',
+        lambda: (grammar_to_trees(problem['grammar'], max_depth), {}),
+        track_memory
+    )
+    record['items'] = len(trees)
+    record['items_per_sec'] = len(trees) / record['seconds'] if record['seconds'] > 0 else None
+    records.append(record)
+
+    sampler = ValuesSampler(val_range, engine=engine, storage=storage)
+
+    def _populate():
+        for tree in trees:
+            sampler.populate(tree[0])
+        return None, {'items': len(trees), 'tables': sampler.memory_report()}
+
+    _, record = run_stage('populate', _populate, track_memory)
+    records.append(record)
+
+    def _pick_values():
+        batch = engine == 'numpy'
+        values = sampler.pick_values_dset(trees, n_samples, pbar=False, batch=batch)
+        return values, {'items': len(trees) * n_samples, 'batch': batch}
+
+    values, record = run_stage('pick_values', _pick_values, track_memory)
+    records.append(record)
+
+    def _render():
+        plans = {}
+        for tree, (tree_vals, _, _) in zip(trees, values):
+            shape = tree_template(tree[0])[0]
+            key = str(shape)
+            if key not in plans:
+                plans[key] = RenderPlan.compile(shape, problem)
+            plans[key].render([tree_leaves(tv) for tv in tree_vals])
+        return None, {'items': len(trees) * n_samples}
+
+    _, record = run_stage('render', _render, track_memory)
+    records.append(record)
+
+    return records
+
+
+def compare(results, baseline, tolerance, min_seconds):
+    '''
+    Stages that got slower than baseline by more than tolerance (a fraction). Stages
+    faster than min_seconds in the baseline are reported but too noisy to fail on.
+    '''
+    baseline_seconds = {(r['config'], r['stage']): r['seconds'] for r in baseline['results']}
+
+    regressions = []
+    for r in results:
+        key = (r['config'], r['stage'])
+        if key not in baseline_seconds or baseline_seconds[key] <= 0:
+            continue
+
+        ratio = r['seconds'] / baseline_seconds[key]
+        print(f'{r["config"]:<40} {r["stage"]:<18} {r["seconds"]:8.3f}s vs {baseline_seconds[key]:8.3f}s ({ratio:.2f}x)')
+
+        if ratio > 1 + tolerance and baseline_seconds[key] >= min_seconds:
+            regressions.append({'config': r['config'], 'stage': r['stage'], 'ratio': ratio})
+
+    return regressions
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+
+    args.add_argument('out_path', type=str, help='results json')
+    args.add_argument('--matrix', type=str, default='quick', choices=list(MATRICES))
+    args.add_argument('--no_memory', action='store_true', help='skip tracemalloc, which slows every stage')
+    args.add_argument('--baseline', type=str, default=None, help='results json to compare against')
+    args.add_argument('--tolerance', type=float, default=0.25, help='allowed slowdown before failing')
+    args.add_argument('--min_seconds', type=float, default=0.05, help='ignore regressions in stages faster than this')
+    args.add_argument('--repeat', type=int, default=3, help='keep the fastest of this many runs')
+
+    args = args.parse_args()
+
+    results = []
+    for config in MATRICES[args.matrix]:
+        name = config_name(*config)
+        print(f'running {name}')
+
+        runs = [bench_config(*config, track_memory=not args.no_memory) for _ in range(args.repeat)]
+
+        for stage_runs in zip(*runs):
+            record = min(stage_runs, key=lambda r: r['seconds'])
+            record['config'] = name
+            results.append(record)
+
+            print(f'  {record["stage"]:<18} {record["seconds"]:8.3f}s' + (
+                f'  peak {record["peak_bytes"] / 2**20:8.1f}MB' if 'peak_bytes' in record else ''
+            ))
+
+    with open(args.out_path, 'w') as f:
+        json.dump({
+            'meta': {
+                'python': sys.version,
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'matrix': args.matrix,
+                'track_memory': not args.no_memory
+            },
+            'results': results
+        }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if baseline['meta']['track_memory'] != (not args.no_memory):
+            print('warning: baseline was recorded with different memory tracking, times are not comparable')
+
+        regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+        if regressions:
+            print(f'{len(regressions)} regressions over {args.tolerance:.0%}:')
+            for r in regressions:
+                print(f'  {r["config"]} {r["stage"]}: {r["ratio"]:.2f}x')
+            sys.exit(1)
+
+        print('no regressions')
@@ -0,0 +1,96 @@
+import json
+import time
+import argparse
+import numpy as np
+
+from mwp.build import ProblemBuilder
+from mwp.model import SimulatedModel
+from mwp.search import ProblemSpace, ThompsonOpt, UniformOpt, make_model_reward, make_concurrent_model_reward
+
+
+args = argparse.ArgumentParser()
+
+# specify problems
+args.add_argument('--problem', type=str, default='jobs')
+args.add_argument('--max_depth', type=int, default=10)
+args.add_argument('--n_samples', type=int, default=100)
+
+# simulated model
+args.add_argument('--base_error', type=float, default=0.05)
+args.add_argument('--error_rules', type=str, default='{"op:+>+": 1.0, "op:/": 0.8}', help='json: feature -> log-odds per occurrence')
+args.add_argument('--latency', type=float, default=0.0)
+args.add_argument('--latency_jitter', type=float, default=0.0)
+args.add_argument('--max_concurrency', type=int, default=1)
+
+# search
+args.add_argument('--budget', type=int, default=2500)
+args.add_argument('--samples_per_pull', type=int, default=10)
+args.add_argument('--top_k', type=int, default=5)
+args.add_argument('--seeds', type=int, default=3)
+args.add_argument('--out', type=str, default=None, help='write results as json')
+
+args = args.parse_args()
+
+print('generating problems')
+builder = ProblemBuilder(args.problem, engine='numpy', storage='csr')
+df = builder.build_dataset(args.max_depth, args.n_samples, batch=True)
+
+model = SimulatedModel(
+    df,
+    error_rules=json.loads(args.error_rules),
+    base_error=args.base_error,
+    latency=args.latency,
+    latency_jitter=args.latency_jitter,
+    seed=0
+)
+
+if args.max_concurrency > 1:
+    reward_func = make_concurrent_model_reward(model, max_concurrency=args.max_concurrency)
+else:
+    reward_func = make_model_reward(model)
+
+# the hardest arms under the simulated error rules
+ps = ProblemSpace(df, replace=True)
+true_success = np.array([1 - model.error_rate(ps.arm_tree(i)) for i in range(ps.num_arms())])
+hard_arms = set(np.argsort(true_success, kind='stable')[:args.top_k].tolist())
+
+print(f'hardest arms: {sorted(hard_arms)} with success {sorted(true_success[list(hard_arms)].round(3).tolist())}')
+
+results = []
+for name, make_opt in [
+        ('thompson', lambda ps: ThompsonOpt(ps, reward_func)),
+        ('uniform', lambda ps: UniformOpt(ps, reward_func))
+    ]:
+    for seed in range(args.seeds):
+        np.random.seed(seed)
+
+        opt = make_opt(ProblemSpace(df, replace=True))
+
+        start = time.perf_counter()
+        ranked_arms, _ = opt.optimize(args.budget, args.samples_per_pull, maximize=False)
+        wall_time = time.perf_counter() - start
+
+        recovered = len(hard_arms & set(ranked_arms[:args.top_k]))
+
+        results.append({
+            'optimizer': name,
+            'seed': seed,
+            'wall_time': wall_time,
+            'samples_per_sec': opt.pulls.sum() / wall_time,
+            'recovery': recovered / args.top_k
+        })
+
+        print(f'{name} seed {seed}: {wall_time:.2f}s, {results[-1]["samples_per_sec"]:.0f} samples/s, recovered {recovered}/{args.top_k} hard arms')
+
+print('summary')
+for name in ('thompson', 'uniform'):
+    runs = [r for r in results if r['optimizer'] == name]
+    print(
+        f'{name}: wall time {np.mean([r["wall_time"] for r in runs]):.2f}s, '
+        f'{np.mean([r["samples_per_sec"] for r in runs]):.0f} samples/s, '
+        f'recovery {np.mean([r["recovery"] for r in runs]):.2f}'
+    )
+
+if args.out:
+    with open(args.out, 'w') as f:
+        json.dump({'args': vars(args), 'hard_arms': sorted(hard_arms), 'results': results}, f, indent=2)
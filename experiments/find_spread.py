@@ -3,9 +3,11 @@ import os
 import argparse
 import pickle
 
-from mwp.search import ProblemSpace, ThompsonOpt, make_model_reward
-from mwp.model import ClaudeModel
+from mwp.search import ProblemSpace, LazyProblemSpace, ThompsonOpt, TwoSidedThompsonOpt, FeatureThompsonOpt, LUCBOpt, make_model_reward, make_concurrent_model_reward
+from mwp.model import ClaudeModel, CachedModel, LocalBatchModel
 from mwp.build import ProblemBuilder
+from mwp.dataset import save_dataset, load_dataset, is_dataset_dir
+from mwp.metrics import metrics
 
 
 args = argparse.ArgumentParser()
@@ -17,21 +19,51 @@ args.add_argument('--problem', type=str, default='jobs')
 args.add_argument('--max_depth', type=int, default=12)
 args.add_argument('--min_depth', type=int, default=0)
 args.add_argument('--subsample_trees', type=int, default=None)
+args.add_argument('--canonical', action='store_true')
 
 # specify samples from trees
 args.add_argument('--n_samples', type=int, default=100)
-args.add_argument('--problem_save', type=str, default='data/samples_10.pkl')
+args.add_argument('--problem_save', type=str, default='data/samples_10.pkl', help='a pickle, or a save_dataset directory for paths without an extension')
+args.add_argument('--lazy', action='store_true', help='generate samples only for pulled arms')
+args.add_argument('--max_cached_arms', type=int, default=None)
 
 # define optimization parameters
 args.add_argument('--budget', type=int, default=100)
 args.add_argument('--samples_per_pull', type=int, default=10)
+args.add_argument('--q', type=int, default=1, help='arms pulled concurrently per round')
+args.add_argument('--two_sided', action='store_true', help='find minima and maxima from one budget')
+args.add_argument('--features', action='store_true', help='share statistics across arms through tree features')
+args.add_argument('--early_stop', action='store_true', help='stop once the top_k arms are identified (LUCB)')
+args.add_argument('--top_k', type=int, default=5)
+args.add_argument('--delta', type=float, default=0.1, help='early stopping error probability')
+args.add_argument('--journal_dir', type=str, default=None, help='journal every pull here and resume from it')
+
+# model calls
+args.add_argument('--max_concurrency', type=int, default=1)
+args.add_argument('--rate_limit', type=float, default=None, help='max requests per second')
+args.add_argument('--cache_path', type=str, default=None, help='sqlite file caching model predictions')
+args.add_argument('--stream', action='store_true', help='stream predictions and stop once the answer is parsed, which can change grades when the model keeps writing numbers after its answer')
+args.add_argument('--pack', type=int, default=None, help='ask this many problems per request, falling back to single requests for unparsed answers')
+args.add_argument('--base_url', type=str, default=None, help='model API server, e.g. experiments/stream_server.py')
+args.add_argument('--local_batch', action='store_true', help='use a local batch inference server at base_url')
+
+args.add_argument('--metrics_path', type=str, default=None, help='append structured metric events here (jsonl)')
 
 args = args.parse_args()
 
+if args.metrics_path:
+    metrics.set_sink(args.metrics_path)
+
 # read problems
-if os.path.exists(args.problem_save):
+if args.lazy:
+    problem = ProblemBuilder(args.problem, engine='numpy', storage='csr')
+elif os.path.exists(args.problem_save):
     print('loading problems')
-    df = pd.read_pickle(args.problem_save)
+    if not is_dataset_dir(args.problem_save):
+        df = pd.read_pickle(args.problem_save)
+    else:
+        # only what the search and the model need
+        df = load_dataset(args.problem_save, columns=['expression', 'expression_str', 'tree', 'target_val', 'problem', 'question'])
     print(f'found {len(df)} problems')
 else:
     print('generating problems')
@@ -40,26 +72,106 @@ else:
         args.max_depth,
         args.n_samples,
         min_depth=args.min_depth,
-        subsample=args.subsample_trees
+        subsample=args.subsample_trees,
+        canonical=args.canonical
     )
     
     print(f'sampled {len(df)} problems')
 
-    df.to_pickle(args.problem_save)
+    if is_dataset_dir(args.problem_save):
+        save_dataset(df, args.problem_save)
+    else:
+        df.to_pickle(args.problem_save)
 
 # init model
-model = ClaudeModel(model_name='claude-instant-v1.2')
-reward_func = make_model_reward(model, max_tokens=1024, verbose=False)
+if args.local_batch:
+    model = LocalBatchModel(args.base_url)
+else:
+    model = ClaudeModel(model_name='claude-instant-v1.2', base_url=args.base_url)
+if args.cache_path:
+    model = CachedModel(model, args.cache_path)
+if args.max_concurrency > 1 or args.rate_limit is not None:
+    reward_func = make_concurrent_model_reward(
+        model,
+        max_concurrency=args.max_concurrency,
+        rate_limit=args.rate_limit,
+        stream=args.stream,
+        pack=args.pack,
+        max_tokens=1024,
+        verbose=False
+    )
+else:
+    reward_func = make_model_reward(model, stream=args.stream, pack=args.pack, max_tokens=1024, verbose=False)
 
 # search for best and worst problems
+def journal_path(save_file: str) -> str:
+    if args.journal_dir is None or save_file is None:
+        return None
+
+    os.makedirs(args.journal_dir, exist_ok=True)
+    return os.path.join(args.journal_dir, f'{save_file}.jsonl')
+
+def make_problem_space():
+    if args.lazy:
+        return LazyProblemSpace(
+            problem,
+            args.max_depth,
+            n_samples=args.n_samples,
+            min_depth=args.min_depth,
+            replace=True,
+            canonical=args.canonical,
+            subsample=args.subsample_trees,
+            max_cached_arms=args.max_cached_arms
+        )
+    else:
+        return ProblemSpace(df, replace=True, canonical=args.canonical)
+
 def find_extrema(maximize: bool, save_file: str = None) -> tuple[list[int], dict[int, float]]:
-    ps = ProblemSpace(df, replace=True)
-    opt = ThompsonOpt(ps, reward_func, beta_prior=(1, 1))
+    ps = make_problem_space()
+    if args.early_stop:
+        opt = LUCBOpt(ps, reward_func, k=args.top_k, delta=args.delta)
+        ranked_arms, arm_vals = opt.optimize(
+            budget=args.budget,
+            samples_per_pull=args.samples_per_pull,
+            maximize=maximize,
+            verbose=True,
+            journal=journal_path(save_file)
+        )
+        print(f'budget saved: {opt.budget_saved}, confidence bounds: {opt.bounds}')
+    elif args.features:
+        opt = FeatureThompsonOpt(ps, reward_func)
+        ranked_arms, arm_vals = opt.optimize(
+            budget=args.budget,
+            samples_per_pull=args.samples_per_pull,
+            maximize=maximize,
+            verbose=True,
+            journal=journal_path(save_file)
+        )
+        print('feature weights:', opt.coefficients())
+    else:
+        opt = ThompsonOpt(ps, reward_func, beta_prior=(1, 1))
+        ranked_arms, arm_vals = opt.optimize(
+            budget=args.budget,
+            samples_per_pull=args.samples_per_pull,
+            maximize=maximize,
+            verbose=True,
+            q=args.q,
+            journal=journal_path(save_file)
+        )
+
+    if save_file:
+        opt.save(save_file)
+
+    return ranked_arms, arm_vals, opt.get_logs()
+
+def find_both_extrema(save_file: str = None) -> tuple[list[int], dict[int, float]]:
+    ps = make_problem_space()
+    opt = TwoSidedThompsonOpt(ps, reward_func, beta_prior=(1, 1))
     ranked_arms, arm_vals = opt.optimize(
         budget=args.budget,
         samples_per_pull=args.samples_per_pull,
-        maximize=maximize,
-        verbose=True
+        verbose=True,
+        journal=journal_path(save_file)
     )
 
     if save_file:
@@ -67,11 +179,22 @@ def find_extrema(maximize: bool, save_file: str = None) -> tuple[list[int], dict
 
     return ranked_arms, arm_vals, opt.get_logs()
 
-print('finding minima')
-worst_arms, est_success_w, logs_w = find_extrema(maximize=False, save_file='minima')
+if args.two_sided:
+    print('finding minima and maxima')
+    best_arms, est_success_b, logs_b = find_both_extrema(save_file='extrema')
+    worst_arms, est_success_w, logs_w = best_arms[::-1], est_success_b, logs_b
+else:
+    print('finding minima')
+    worst_arms, est_success_w, logs_w = find_extrema(maximize=False, save_file='minima')
+
+    print('finding maxima')
+    best_arms, est_success_b, logs_b = find_extrema(maximize=True, save_file='maxima')
+
+if args.cache_path:
+    print('prediction cache:', model.stats())
 
-print('finding maxima')
-best_arms, est_success_b, logs_b = find_extrema(maximize=True, save_file='maxima')
+print('metrics:', metrics.snapshot())
+metrics.event('summary', **metrics.snapshot())
 
 print('saving results')
 with open(args.output_path, 'wb') as f:
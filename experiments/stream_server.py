@@ -0,0 +1,147 @@
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class CompletionHandler(BaseHTTPRequestHandler):
+    '''
+    Local stand-in for the completions endpoint, for testing streaming predictions without
+    the API. Every request gets the server's response text, streamed as server-sent events
+    a few words at a time (or in one piece without stream). Counts how many chunks each
+    streamed request received before the client hung up.
+
+    Also serves /v1/batch for LocalBatchModel, answering every prompt of a batch with the
+    response text, and counts connections to show whether clients reuse them.
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.stats['connections'] += 1
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+
+        server = self.server
+        with server.lock:
+            server.stats['requests'] += 1
+
+        if self.path.rstrip('/').endswith('/v1/batch'):
+            time.sleep(server.delay)
+            self._send_json({'completions': [server.response] * len(body['prompts'])})
+            return
+
+        if not body.get('stream'):
+            self._send_json({
+                'type': 'completion',
+                'id': 'compl_local',
+                'completion': server.response,
+                'stop_reason': 'stop_sequence',
+                'model': body['model']
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        words = server.response.split(' ')
+        chunks = [' '.join(words[i:i + server.chunk_words]) + ' ' for i in range(0, len(words), server.chunk_words)]
+
+        sent = 0
+        try:
+            for chunk in chunks:
+                self._send_event('completion', {
+                    'type': 'completion',
+                    'id': 'compl_local',
+                    'completion': chunk,
+                    'stop_reason': None,
+                    'model': body['model']
+                })
+                sent += 1
+                time.sleep(server.delay)
+
+            self._send_event('completion', {
+                'type': 'completion',
+                'id': 'compl_local',
+                'completion': '',
+                'stop_reason': 'stop_sequence',
+                'model': body['model']
+            })
+        except (BrokenPipeError, ConnectionResetError):
+            with server.lock:
+                server.stats['cancelled'] += 1
+        finally:
+            with server.lock:
+                server.stats['chunks_sent'] += sent
+                server.stats['chunks_total'] += len(chunks)
+
+            self.close_connection = True
+
+    def _send_event(self, event: str, data: dict):
+        self.wfile.write(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode('utf-8'))
+        self.wfile.flush()
+
+    def _send_json(self, data: dict):
+        payload = json.dumps(data).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(
+        response: str,
+        host: str = '127.0.0.1',
+        port: int = 0,
+        chunk_words: int = 2,
+        delay: float = 0.0
+    ) -> ThreadingHTTPServer:
+    '''
+    A stand-in server answering every completion with response. Port 0 picks a free port,
+    see server.server_address. Point ClaudeModel at it with base_url=f'http://{host}:{port}'.
+    '''
+    server = ThreadingHTTPServer((host, port), CompletionHandler)
+
+    server.response = response
+    server.chunk_words = chunk_words
+    server.delay = delay
+
+    server.lock = threading.Lock()
+    server.stats = {'connections': 0, 'requests': 0, 'cancelled': 0, 'chunks_sent': 0, 'chunks_total': 0}
+
+    return server
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+
+    args.add_argument('--host', type=str, default='127.0.0.1')
+    args.add_argument('--port', type=int, default=8765)
+    args.add_argument('--answer', type=int, default=6)
+    args.add_argument('--trailing_words', type=int, default=200, help='words generated after the answer')
+    args.add_argument('--chunk_words', type=int, default=2)
+    args.add_argument('--delay', type=float, default=0.01, help='seconds between chunks')
+
+    args = args.parse_args()
+
+    response = f'Working through the problem step by step. The answer is {args.answer}. ' + ' '.join(['More reasoning.'] * (args.trailing_words // 2))
+
+    server = make_server(response, args.host, args.port, args.chunk_words, args.delay)
+    print(f'serving on http://{args.host}:{args.port}')
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(server.stats)
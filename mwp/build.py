@@ -1,28 +1,60 @@
-import pandas as pd
+import os
+import json
+import time
+import random
+import shutil
+import tempfile
 import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from tqdm.auto import tqdm
-tqdm.pandas()
 
 from mwp.problems.base import Constant, Operation
 from mwp.problems.problems import PROBLEMS
-from mwp.trees import grammar_to_trees, ValuesSampler
+from mwp.problems.render import RenderPlan
+from mwp.dataset import save_dataset, is_dataset_dir, MANIFEST_FILE
+from mwp.metrics import metrics
+from mwp.trees import grammar_to_trees, iter_trees, ValuesSampler, TreeCounter
 from mwp.trees.utils import random_sample
+from mwp.trees.samples import tree_template, tree_leaves
 
 
 class ProblemBuilder:
     def __init__(
             self,
             problem_name: str,
+            engine: str = 'python',
+            storage: str = 'dict',
+            cache_dir: str = None,
+            cache_key: str = ''
         ):
         self.op_map, self.problem = PROBLEMS[problem_name]()
         self.grammar = self.problem['grammar']
-        self.sampler = ValuesSampler(self.problem['val_range'])
+        self.counter = TreeCounter(self.grammar)
+        self.render_plans = {}
+        self.sampler = ValuesSampler(
+            self.problem['val_range'],
+            engine=engine,
+            storage=storage,
+            cache_dir=cache_dir,
+            cache_key=cache_key
+        )
+
+    def get_trees(self, max_depth, min_depth=0, canonical=False) -> tuple:
+        return grammar_to_trees(self.grammar, max_depth, min_depth=min_depth, canonical=canonical)
+
+    def iter_trees(self, max_depth, min_depth=0, canonical=False):
+        return iter_trees(self.grammar, max_depth, min_depth=min_depth, canonical=canonical)
+
+    def count_trees(self, max_depth, min_depth=0) -> int:
+        return self.counter.count(max_depth, min_depth=min_depth)
 
-    def get_trees(self, max_depth, min_depth=0) -> tuple:
-        return grammar_to_trees(self.grammar, max_depth, min_depth=min_depth)
+    def sample_trees(self, n, max_depth, min_depth=0) -> tuple:
+        return self.counter.sample(n, max_depth, min_depth=min_depth)
 
-    def get_tree_values(self, trees, n_samples) -> list[tuple]:
-        return self.sampler.pick_values_dset(trees, n_samples)
+    def get_tree_values(self, trees, n_samples, batch=False) -> list[tuple]:
+        return self.sampler.pick_values_dset(trees, n_samples, batch=batch)
 
     def _build_from_tree(self, parse_tree, used_vals):
         if not isinstance(parse_tree[1], list):
@@ -57,70 +89,325 @@ class ProblemBuilder:
 
         return problem_text, target_question
 
-    def build_dataset(self, max_depth, n_samples, min_depth=0, subsample=None) -> pd.DataFrame:
-        print('generating trees')
-        exprs, trees = self.get_trees(max_depth, min_depth=min_depth)
-        
-        print('num trees:', len(trees))
+    def get_render_plan(self, shape: list) -> RenderPlan:
+        key = str(shape)
+        if key not in self.render_plans:
+            self.render_plans[key] = RenderPlan.compile(shape, self.problem)
 
-        if subsample is not None:
-            exprs, trees = random_sample(subsample, exprs, trees)
+        return self.render_plans[key]
 
-            print('num subsampled trees:', len(trees))
+    def build_rows(self, tree_iter, n_samples, batch=False, pbar=True) -> tuple[list[dict], int]:
+        '''
+        Sample values for and render every (expr, [tree]) of tree_iter.
+        Returns the dataset rows and the number of trees.
+        '''
+        num_trees = 0
+        rows = []
+        for expr, tree in tqdm(tree_iter, desc='Sampling values', disable=not pbar):
+            with metrics.timer('build.sample'):
+                if batch:
+                    sample_batch = self.sampler.pick_values_batch(tree[0], n_samples)
+                    tree_vals, tree_strs, target_vals = sample_batch.as_tuples()
+                    shape, leaf_vals = sample_batch.shape, sample_batch.leaf_matrix()
+                else:
+                    samples = self.sampler.pick_values_dset([tree], n_samples, pbar=False)[0]
+                    tree_vals, tree_strs, target_vals = samples
+                    shape, leaf_vals = tree_template(tree[0])[0], [tree_leaves(tv) for tv in tree_vals]
 
-        # num_trees sized list[tuple(tree_vals, tree_strs, target_vals)]
-        tree_samples = self.get_tree_values(trees, n_samples)
+            # each structure is compiled once, then rendered for the whole batch
+            with metrics.timer('build.render'):
+                problems, questions = self.get_render_plan(shape).render(leaf_vals)
 
-        assert len(exprs) == len(trees) == len(tree_samples)
+            metrics.incr('build.trees')
+            metrics.incr('build.samples', len(problems))
 
-        rows = []
-        for expr, tree, samples in zip(exprs, trees, tree_samples):
-            tree_vals, tree_strs, target_vals = samples
-            
-            for tree_val, tree_str, target_val in zip(tree_vals, tree_strs, target_vals):
+            for tree_val, tree_str, target_val, problem, question in zip(tree_vals, tree_strs, target_vals, problems, questions):
                 rows.append({
                     'expression': expr,
                     'tree': tree,
                     'tree_vals': tree_val,
                     'tree_str': tree_str,
-                    'target_val': target_val
+                    'target_val': target_val,
+                    'problem': problem,
+                    'question': question
                 })
-        
+
+            num_trees += 1
+
+        return rows, num_trees
+
+    def build_dataset(
+            self,
+            max_depth,
+            n_samples,
+            min_depth=0,
+            subsample=None,
+            batch=False,
+            canonical=False
+        ) -> pd.DataFrame:
+        if subsample is not None and canonical:
+            # the counter works on raw derivations, so canonical trees are enumerated
+            print('generating trees')
+            exprs, trees = self.get_trees(max_depth, min_depth=min_depth, canonical=True)
+
+            print('num trees:', len(trees))
+
+            exprs, trees = random_sample(subsample, exprs, trees)
+
+            print('num subsampled trees:', len(trees))
+
+            tree_iter = zip(exprs, trees)
+        elif subsample is not None:
+            print('num trees:', self.count_trees(max_depth, min_depth=min_depth))
+
+            # draw uniformly without enumerating the whole space
+            exprs, trees = self.sample_trees(subsample, max_depth, min_depth=min_depth)
+
+            print('num subsampled trees:', len(trees))
+
+            tree_iter = zip(exprs, trees)
+        else:
+            # stream trees straight from the grammar
+            tree_iter = self.iter_trees(max_depth, min_depth=min_depth, canonical=canonical)
+
+        start = time.perf_counter()
+        rows, num_trees = self.build_rows(tree_iter, n_samples, batch=batch)
+        seconds = time.perf_counter() - start
+
+        metrics.event('build_dataset', trees=num_trees, samples=len(rows), seconds=seconds, samples_per_sec=len(rows) / seconds if seconds > 0 else None)
+
+        if subsample is None:
+            print('num trees:', num_trees)
+
         print('num samples:', len(rows))
 
         df = pd.DataFrame(rows)
 
-        def _add_problem_text(row):
-            root, node_list = self.build_from_tree(row['tree_vals'])
-            problem, question = self.get_problem_text(root, node_list)
-            row['problem'] = problem
-            row['question'] = question
-            return row
-        
-        print('rendering problems from trees')
-        df = df.progress_apply(_add_problem_text, axis=1)
-
         print('dataframe:', df.columns)
 
         return df
 
 
+# each worker process builds its own ProblemBuilder once, so memoized tables are reused across shards
+_worker_builder = None
+
+def _init_worker(problem_name, engine, storage, cache_dir, cache_key):
+    global _worker_builder
+    _worker_builder = ProblemBuilder(problem_name, engine=engine, storage=storage, cache_dir=cache_dir, cache_key=cache_key)
+
+def _build_shard(out_dir, shard_name, seed, n_samples, max_depth, min_depth=0, batch=False, ranks=None, trees=None) -> dict:
+    # seeded per shard so the output does not depend on which worker ran it
+    random.seed(seed)
+    np.random.seed(seed)
+
+    if ranks is not None:
+        trees = [_worker_builder.counter.unrank(k, max_depth, min_depth=min_depth) for k in ranks]
+
+    rows, num_trees = _worker_builder.build_rows(trees, n_samples, batch=batch, pbar=False)
+
+    # write to a temporary directory, then rename so a shard directory is always complete
+    tmp_path = tempfile.mkdtemp(dir=out_dir, prefix='.tmp-')
+    try:
+        save_dataset(pd.DataFrame(rows), tmp_path)
+        os.rename(tmp_path, os.path.join(out_dir, shard_name))
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    return {'trees': num_trees, 'rows': len(rows)}
+
+def _write_manifest(out_dir, manifest):
+    tmp_path = os.path.join(out_dir, MANIFEST_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, os.path.join(out_dir, MANIFEST_FILE))
+
+def build_sharded(
+        out_dir,
+        problem_name,
+        max_depth,
+        n_samples,
+        num_shards,
+        workers=None,
+        min_depth=0,
+        subsample=None,
+        batch=False,
+        canonical=False,
+        seed=0,
+        engine='python',
+        storage='dict',
+        cache_dir=None,
+        cache_key=''
+    ) -> dict:
+    '''
+    Build a dataset in num_shards shards over a process pool, writing each shard to
+    out_dir/shard-XXXXX as it finishes. Shards already on disk are skipped, so an
+    interrupted build can be rerun with the same arguments. Load with load_dataset(out_dir).
+    '''
+    config = {
+        'problem': problem_name,
+        'max_depth': max_depth,
+        'min_depth': min_depth,
+        'n_samples': n_samples,
+        'subsample': subsample,
+        'batch': batch,
+        'canonical': canonical,
+        'seed': seed
+    }
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    manifest_path = os.path.join(out_dir, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        if manifest['config'] != config:
+            raise ValueError(f'{out_dir} holds a build with a different config: {manifest["config"]}')
+    else:
+        manifest = {'config': config, 'shards': {}}
+
+    builder = ProblemBuilder(problem_name, engine=engine, storage=storage, cache_dir=cache_dir, cache_key=cache_key)
+
+    # partition the trees; workers unrank their own trees unless canonical trees need enumerating
+    random.seed(seed)
+    if canonical:
+        exprs, trees = builder.get_trees(max_depth, min_depth=min_depth, canonical=True)
+        if subsample is not None:
+            exprs, trees = random_sample(subsample, exprs, trees)
+        items = list(zip(exprs, trees))
+    elif subsample is not None:
+        items = builder.counter.sample_ranks(subsample, max_depth, min_depth=min_depth)
+    else:
+        items = range(builder.count_trees(max_depth, min_depth=min_depth))
+
+    print('num trees:', len(items))
+
+    num_shards = max(1, min(num_shards, len(items)))
+    bounds = [len(items) * i // num_shards for i in range(num_shards + 1)]
+
+    if manifest.get('num_shards', num_shards) != num_shards:
+        raise ValueError(f'{out_dir} was built with {manifest["num_shards"]} shards')
+    manifest['num_shards'] = num_shards
+
+    pending = []
+    for i in range(num_shards):
+        shard_name = f'shard-{i:05d}'
+        shard_path = os.path.join(out_dir, shard_name)
+
+        if os.path.exists(shard_path):
+            if shard_name not in manifest['shards']:
+                # finished after the last manifest write
+                with open(os.path.join(shard_path, 'meta.json')) as f:
+                    manifest['shards'][shard_name] = {'trees': bounds[i + 1] - bounds[i], 'rows': json.load(f)['num_rows']}
+            continue
+
+        pending.append((i, shard_name))
+
+    print(f'{num_shards - len(pending)} of {num_shards} shards already built')
+
+    _write_manifest(out_dir, manifest)
+
+    if pending:
+        with ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=_init_worker,
+                initargs=(problem_name, engine, storage, cache_dir, cache_key)
+            ) as executor:
+            futures = {}
+            for i, shard_name in pending:
+                shard_items = items[bounds[i]:bounds[i + 1]]
+                kwargs = {'trees': shard_items} if canonical else {'ranks': shard_items}
+
+                future = executor.submit(
+                    _build_shard, out_dir, shard_name, seed + i, n_samples, max_depth,
+                    min_depth=min_depth, batch=batch, **kwargs
+                )
+                futures[future] = shard_name
+
+            for future in tqdm(as_completed(futures), total=len(futures), desc='Building shards'):
+                manifest['shards'][futures[future]] = future.result()
+                _write_manifest(out_dir, manifest)
+
+    print('num samples:', sum(shard['rows'] for shard in manifest['shards'].values()))
+
+    return manifest
+
+
 if __name__ == '__main__':
     args = argparse.ArgumentParser()
 
-    args.add_argument('out_path', type=str)
+    args.add_argument('out_path', type=str, help='a pickle, or a save_dataset directory for paths without an extension')
 
     args.add_argument('--problem', type=str, default='jobs')
     args.add_argument('--max_depth', type=int, default=12)
     args.add_argument('--min_depth', type=int, default=0)
     args.add_argument('--n_samples', type=int, default=100)
+    args.add_argument('--engine', type=str, default='python', choices=ValuesSampler.ENGINES)
+    args.add_argument('--storage', type=str, default='dict', choices=ValuesSampler.STORAGES)
+    args.add_argument('--cache_dir', type=str, default=None)
+    args.add_argument('--cache_key', type=str, default='', help='change to invalidate the tables in cache_dir')
+    args.add_argument('--batch', action='store_true')
+    args.add_argument('--canonical', action='store_true')
+    args.add_argument('--subsample', type=int, default=None)
+
+    # sharded builds write a directory of shards and can be resumed
+    args.add_argument('--shards', type=int, default=None)
+    args.add_argument('--workers', type=int, default=None)
+    args.add_argument('--seed', type=int, default=0)
+
+    args.add_argument('--metrics_path', type=str, default=None, help='append structured metric events here (jsonl)')
 
     args = args.parse_args()
 
-    problem = ProblemBuilder(args.problem)
-    df = problem.build_dataset(args.max_depth, args.n_samples, min_depth=args.min_depth)
-    print(df.head())
+    if args.metrics_path:
+        metrics.set_sink(args.metrics_path)
+
+    if args.shards is not None:
+        build_sharded(
+            args.out_path,
+            args.problem,
+            args.max_depth,
+            args.n_samples,
+            args.shards,
+            workers=args.workers,
+            min_depth=args.min_depth,
+            subsample=args.subsample,
+            batch=args.batch,
+            canonical=args.canonical,
+            seed=args.seed,
+            engine=args.engine,
+            storage=args.storage,
+            cache_dir=args.cache_dir,
+            cache_key=args.cache_key
+        )
+    else:
+        problem = ProblemBuilder(
+            args.problem,
+            engine=args.engine,
+            storage=args.storage,
+            cache_dir=args.cache_dir,
+            cache_key=args.cache_key
+        )
+        df = problem.build_dataset(
+            args.max_depth,
+            args.n_samples,
+            min_depth=args.min_depth,
+            subsample=args.subsample,
+            batch=args.batch,
+            canonical=args.canonical
+        )
+        print(df.head())
+
+        print('backtrack tables:', problem.sampler.memory_report())
+
+        print(f'sampled {len(df)} problems')
 
-    print(f'sampled {len(df)} problems')
+        print('metrics:', metrics.snapshot())
+        metrics.event('summary', **metrics.snapshot())
 
-    df.to_pickle(args.out_path)
+        # a pickle for any file name, as before, and columnar only for directories
+        if is_dataset_dir(args.out_path):
+            save_dataset(df, args.out_path)
+        else:
+            df.to_pickle(args.out_path)
@@ -0,0 +1,225 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+from nltk.tree import Tree
+
+from mwp.trees.samples import tree_template, fill_template, tree_leaves
+
+
+# bump when the on-disk layout changes
+DATASET_VERSION = 1
+
+COLUMNS = ('expression', 'expression_str', 'tree', 'tree_vals', 'tree_str', 'target_val', 'problem', 'question')
+
+# derived from other columns when loading, so never stored
+DERIVED_COLUMNS = ('expression_str', 'arm_str')
+
+# top-level file of a sharded build (see build_sharded), listing completed shards
+MANIFEST_FILE = 'manifest.json'
+
+
+def _tree_to_json(tree):
+    if not isinstance(tree, Tree):
+        return tree
+    return [tree.label(), [_tree_to_json(child) for child in tree]]
+
+def _tree_from_json(obj):
+    if isinstance(obj, str):
+        return obj
+    return Tree(obj[0], [_tree_from_json(child) for child in obj[1]])
+
+def _save_text(path: str, name: str, values: pd.Series):
+    # dictionary-encoded: int32 codes into a utf-8 blob of unique strings
+    codes, uniques = pd.factorize(values)
+    encoded = [str(u).encode('utf-8') for u in uniques]
+
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+
+    np.save(os.path.join(path, f'{name}.codes.npy'), codes.astype(np.int32))
+    np.save(os.path.join(path, f'{name}.dict_offsets.npy'), offsets)
+    with open(os.path.join(path, f'{name}.dict.bin'), 'wb') as f:
+        f.write(b''.join(encoded))
+
+def _load_text(path: str, name: str, mmap_mode) -> pd.Categorical:
+    codes = np.load(os.path.join(path, f'{name}.codes.npy'), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(path, f'{name}.dict_offsets.npy')).tolist()
+    with open(os.path.join(path, f'{name}.dict.bin'), 'rb') as f:
+        blob = f.read()
+
+    categories = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+    return pd.Categorical.from_codes(codes, categories=pd.Index(categories, dtype=object))
+
+
+def save_dataset(df: pd.DataFrame, path: str):
+    '''
+    Save a build_dataset DataFrame as a directory of column files: one structure table
+    deduplicated by expression, flat int arrays of leaf values, and dictionary-encoded text.
+    '''
+    os.makedirs(path, exist_ok=True)
+
+    if len(df) == 0:
+        # e.g. a build where no tree matched, which may have no columns at all
+        df = df.reindex(columns=list(dict.fromkeys(list(COLUMNS) + list(df.columns))))
+
+    expression_str = df['expression'].apply(lambda x: str(x))
+    structure_idx, _ = pd.factorize(expression_str)
+    _, first_rows = np.unique(structure_idx, return_index=True)
+
+    structures = [
+        {
+            'expression': list(df['expression'].iloc[i]),
+            'tree': [_tree_to_json(t) for t in df['tree'].iloc[i]]
+        }
+        for i in first_rows
+    ]
+
+    with open(os.path.join(path, 'structures.json'), 'w') as f:
+        json.dump(structures, f)
+
+    np.save(os.path.join(path, 'structure_idx.npy'), structure_idx.astype(np.int32))
+
+    leaves = [tree_leaves(tree_vals) for tree_vals in df['tree_vals']]
+    leaf_offsets = np.zeros(len(leaves) + 1, dtype=np.int64)
+    np.cumsum([len(row) for row in leaves], out=leaf_offsets[1:])
+
+    np.save(os.path.join(path, 'leaf_offsets.npy'), leaf_offsets)
+    np.save(os.path.join(path, 'leaf_vals.npy'), np.array([v for row in leaves for v in row], dtype=np.int64))
+    np.save(os.path.join(path, 'target_val.npy'), df['target_val'].to_numpy(dtype=np.int64))
+
+    _save_text(path, 'problem', df['problem'])
+    _save_text(path, 'question', df['question'])
+
+    extra_columns = {}
+    for col in df.columns:
+        if col in COLUMNS or col in DERIVED_COLUMNS:
+            continue
+
+        if pd.api.types.is_numeric_dtype(df[col]):
+            np.save(os.path.join(path, f'{col}.npy'), df[col].to_numpy())
+            extra_columns[col] = 'numeric'
+        elif df[col].map(lambda x: isinstance(x, str)).all():
+            _save_text(path, col, df[col])
+            extra_columns[col] = 'text'
+        else:
+            raise ValueError(f'Cannot store column: {col}')
+
+    # written last, so a directory without meta.json is an incomplete save
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({
+            'version': DATASET_VERSION,
+            'num_rows': len(df),
+            'num_structures': len(structures),
+            'extra_columns': extra_columns
+        }, f)
+
+
+def is_dataset_dir(path: str) -> bool:
+    '''
+    Whether path holds (or should hold) a save_dataset directory rather than a pickle:
+    an existing directory, or a new path without a file extension.
+    '''
+    if os.path.exists(path):
+        return os.path.isdir(path)
+    return os.path.splitext(path)[1] == ''
+
+
+def _concat_shards(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    data = {}
+    for col in frames[0].columns:
+        values = [frame[col] for frame in frames]
+        if isinstance(values[0].dtype, pd.CategoricalDtype):
+            # shards have their own dictionaries
+            data[col] = union_categoricals(values)
+        else:
+            data[col] = np.concatenate([v.to_numpy() for v in values])
+
+    return pd.DataFrame(data)
+
+
+def load_dataset(path: str, columns: list[str] = None, mmap: bool = True) -> pd.DataFrame:
+    '''
+    Load a dataset saved with save_dataset, or a directory of shards from build_sharded.
+    Only the requested columns are built, and numeric arrays are memory-mapped when mmap
+    is set. Text columns and expression_str come back as Categoricals.
+    '''
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        shard_names = sorted(manifest['shards'])
+        if len(shard_names) < manifest['num_shards']:
+            raise ValueError(f'Incomplete build at {path}: {len(shard_names)} of {manifest["num_shards"]} shards')
+
+        frames = [load_dataset(os.path.join(path, name), columns=columns, mmap=mmap) for name in shard_names]
+
+        return _concat_shards(frames)
+
+    meta_path = os.path.join(path, 'meta.json')
+    if not os.path.exists(meta_path):
+        raise FileNotFoundError(f'No dataset found at {path}')
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    if meta['version'] != DATASET_VERSION:
+        raise ValueError(f'Unsupported dataset version: {meta["version"]}')
+
+    extra_columns = meta['extra_columns']
+
+    if columns is None:
+        columns = list(COLUMNS) + list(extra_columns)
+
+    mmap_mode = 'r' if mmap else None
+
+    with open(os.path.join(path, 'structures.json')) as f:
+        structures = json.load(f)
+
+    structure_idx = np.load(os.path.join(path, 'structure_idx.npy'), mmap_mode=mmap_mode)
+
+    exprs = [s['expression'] for s in structures]
+    trees = [[_tree_from_json(t) for t in s['tree']] for s in structures]
+
+    def _broadcast(per_structure):
+        # rows share the per-structure objects instead of copying them
+        arr = np.empty(len(per_structure), dtype=object)
+        arr[:] = per_structure
+        return arr[structure_idx]
+
+    def _leaf_rows():
+        offsets = np.load(os.path.join(path, 'leaf_offsets.npy')).tolist()
+        flat = np.load(os.path.join(path, 'leaf_vals.npy'), mmap_mode=mmap_mode).tolist()
+        return [flat[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+    data = {}
+    for col in columns:
+        if col == 'expression':
+            data[col] = _broadcast(exprs)
+        elif col == 'expression_str':
+            data[col] = pd.Categorical.from_codes(
+                structure_idx,
+                categories=pd.Index([str(e) for e in exprs], dtype=object)
+            )
+        elif col == 'tree':
+            data[col] = _broadcast(trees)
+        elif col in ('tree_vals', 'tree_str'):
+            templates = [tree_template(t[0]) for t in trees]
+            leaf_rows = _leaf_rows()
+            if col == 'tree_vals':
+                data[col] = [fill_template(templates[s][0], row) for s, row in zip(structure_idx.tolist(), leaf_rows)]
+            else:
+                data[col] = [templates[s][1].format(*row) for s, row in zip(structure_idx.tolist(), leaf_rows)]
+        elif col == 'target_val':
+            data[col] = np.load(os.path.join(path, 'target_val.npy'), mmap_mode=mmap_mode)
+        elif col in ('problem', 'question') or extra_columns.get(col) == 'text':
+            data[col] = _load_text(path, col, mmap_mode)
+        elif extra_columns.get(col) == 'numeric':
+            data[col] = np.load(os.path.join(path, f'{col}.npy'), mmap_mode=mmap_mode)
+        else:
+            raise KeyError(col)
+
+    return pd.DataFrame(data)
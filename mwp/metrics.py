@@ -0,0 +1,77 @@
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+
+class Metrics():
+    '''
+    In-process registry of counters and timers, with optional structured events written
+    as JSONL to a sink file. Cheap enough to leave on: recording is a dict update under
+    a lock, and events are only serialized when a sink is set.
+    '''
+    def __init__(self, sink_path: str = None):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+        self.sink = None
+        if sink_path is not None:
+            self.set_sink(sink_path)
+
+    def set_sink(self, path: str):
+        with self.lock:
+            if self.sink is not None:
+                self.sink.close()
+            self.sink = open(path, 'a', buffering=1) if path is not None else None
+
+    def incr(self, name: str, value: float = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self.lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = min(timer[2], seconds)
+                timer[3] = max(timer[3], seconds)
+
+    @contextmanager
+    def timer(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def event(self, name: str, **fields):
+        if self.sink is None:
+            return
+
+        line = json.dumps({'ts': time.time(), 'event': name, **fields}, default=str)
+        with self.lock:
+            if self.sink is not None:
+                self.sink.write(line + '\n')
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'timers': {
+                    name: {'count': count, 'total': total, 'mean': total / count, 'min': t_min, 'max': t_max}
+                    for name, (count, total, t_min, t_max) in self.timers.items()
+                }
+            }
+
+    def reset(self):
+        with self.lock:
+            self.counters = {}
+            self.timers = {}
+
+
+# shared by the build, search and model code
+metrics = Metrics()
@@ -1 +1,4 @@
 from .base import *
+from .cache import CachedModel
+from .simulated import SimulatedModel
+from .local import LocalBatchModel
@@ -1,40 +1,116 @@
 from abc import ABC, abstractmethod
 import anthropic
+import threading
+import httpx
+import time
 import os
 
-from .prompts import get_prompt
+from .prompts import get_prompt, format_packed_problems
+from ..metrics import metrics
+
+
+_http_clients = {}
+_http_clients_lock = threading.Lock()
+
+def pooled_http_client(max_connections: int = 16, keepalive_expiry: float = 30.0, client_class: type = httpx.Client) -> httpx.Client:
+    '''
+    An HTTP client shared by every model with the same pool settings, so connections are
+    kept alive across calls and models instead of being set up per request. SDK clients
+    should pass their own client_class (e.g. anthropic.DefaultHttpxClient) to keep the
+    SDK's defaults for everything but the pool.
+    '''
+    key = (client_class, max_connections, keepalive_expiry)
+    with _http_clients_lock:
+        if key not in _http_clients:
+            _http_clients[key] = client_class(limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=keepalive_expiry
+            ))
+        return _http_clients[key]
 
 
 class Model(ABC):
+    # errors worth retrying, e.g. by make_concurrent_model_reward
+    transient_errors = (ConnectionError, TimeoutError)
+
     @abstractmethod
     def predict(self, input: str) -> str:
         pass
 
+    def predict_stream(self, input: str, **kwargs) -> str:
+        '''
+        Predict, stopping as soon as the final answer can be parsed. Models that cannot
+        stream return the full prediction.
+        '''
+        return self.predict(input, **kwargs)
+
+    def predict_batch(self, inputs: list[str], **kwargs) -> list[str]:
+        '''
+        Predictions for several inputs, in order. Backends that can batch answer them in one
+        round trip; the default predicts one at a time.
+        '''
+        return [self.predict(input, **kwargs) for input in inputs]
+
+    def predict_packed(self, inputs: list[str], **kwargs) -> str:
+        '''
+        One prediction for several problems, read back with parse_packed. Models that cannot
+        pack return None, and the caller falls back to one predict per problem.
+        '''
+        return None
+
+    def parse_packed(self, raw_output: str, k: int) -> list[int]:
+        '''
+        The answers of a predict_packed output, None for each one that failed to parse.
+        '''
+        return [None] * k
+
     @abstractmethod
     def is_correct(self, raw_output: str, answer: int) -> bool:
         pass
 
 
 class ClaudeModel(Model):
-    def __init__(self, model_name: str, prompt: str=get_prompt('basic_cot')):
+    transient_errors = (
+        anthropic.RateLimitError,
+        anthropic.APIConnectionError,
+        anthropic.InternalServerError
+    )
+
+    def __init__(self, model_name: str, prompt: str=get_prompt('basic_cot'), base_url: str = None, max_connections: int = 16):
         self.model_name = model_name
         self.prompt = prompt
 
-        self.key = anthropic.Anthropic(api_key=os.environ['ANTHROPIC_API_KEY'])
+        # base_url points the client at another server, e.g. a local stand-in for testing
+        self.key = anthropic.Anthropic(
+            api_key=os.environ['ANTHROPIC_API_KEY'],
+            base_url=base_url,
+            # the SDK's client class keeps its timeout and redirect defaults
+            http_client=pooled_http_client(max_connections, client_class=anthropic.DefaultHttpxClient)
+        )
+        self.base_url = str(self.key.base_url).rstrip('/')
 
-    def predict(self, input_problem: str, max_tokens: int = 128, verbose: bool=False) -> str:
+        # the few-shot prefix is the same for every call
         fs_example = self.prompt.fs
-        input_template = self.prompt.input_template
+        self.fs_prefix = f"{anthropic.HUMAN_PROMPT} {self.prompt.input_template.format(problem=fs_example[0])}{anthropic.AI_PROMPT} {fs_example[1]}"
 
-        fs_prefix = f"{anthropic.HUMAN_PROMPT} {input_template.format(problem=fs_example[0])}{anthropic.AI_PROMPT} {fs_example[1]}"
+        self.packed_fs_prefix = None
+        if self.prompt.packed_template is not None:
+            fs_problems, fs_output = self.prompt.packed_fs
+            fs_input = self.prompt.packed_template.format(k=len(fs_problems), problems=format_packed_problems(fs_problems))
+            self.packed_fs_prefix = f"{anthropic.HUMAN_PROMPT} {fs_input}{anthropic.AI_PROMPT} {fs_output}"
 
-        model_input_str = f"{fs_prefix}"
-        model_input_str += f"{anthropic.HUMAN_PROMPT} {input_template.format(problem=input_problem)}{anthropic.AI_PROMPT}"
+    def _input_str(self, input_problem: str) -> str:
+        return f"{self.fs_prefix}{anthropic.HUMAN_PROMPT} {self.prompt.input_template.format(problem=input_problem)}{anthropic.AI_PROMPT}"
+
+    def predict(self, input_problem: str, max_tokens: int = 128, verbose: bool=False) -> str:
+        model_input_str = self._input_str(input_problem)
 
         if verbose:
             print('>' * 80)
             print(model_input_str)
 
+        start = time.perf_counter()
         model_output = self.key.completions.create(
             prompt=model_input_str,
             stop_sequences=[anthropic.HUMAN_PROMPT],
@@ -42,14 +118,124 @@ class ClaudeModel(Model):
             max_tokens_to_sample=max_tokens,
             temperature=0.0
         )
+        seconds = time.perf_counter() - start
+
+        model_output_str = model_output.completion.strip()
+
+        self._record_call(model_input_str, model_output_str, seconds, getattr(model_output, 'usage', None))
+
+        if verbose:
+            print('<' * 80)
+            print(model_output_str)
+
+        return model_output_str
+
+    def predict_stream(self, input_problem: str, max_tokens: int = 128, verbose: bool=False) -> str:
+        '''
+        Stream the completion, running the prompt's stream_parser on the text so far, and
+        cancel the request once it returns an answer. Grades can differ from predict: if
+        the full output would have gone on to write more numbers after the answer sentence,
+        the prompt's parser could have picked one of those instead.
+        '''
+        model_input_str = self._input_str(input_problem)
+        stream_parser = self.prompt.stream_parser
+
+        if verbose:
+            print('>' * 80)
+            print(model_input_str)
+
+        start = time.perf_counter()
+        stream = self.key.completions.create(
+            prompt=model_input_str,
+            stop_sequences=[anthropic.HUMAN_PROMPT],
+            model=self.model_name,
+            max_tokens_to_sample=max_tokens,
+            temperature=0.0,
+            stream=True
+        )
+
+        chunks = []
+        cancelled = False
+        try:
+            for event in stream:
+                chunks.append(event.completion)
+
+                if stream_parser is not None and stream_parser(''.join(chunks)) is not None:
+                    cancelled = True
+                    break
+        finally:
+            # closing the response drops the connection, which stops generation
+            stream.close()
+        seconds = time.perf_counter() - start
+
+        model_output_str = ''.join(chunks).strip()
+
+        if cancelled:
+            metrics.incr('model.stream_cancelled')
+        self._record_call(model_input_str, model_output_str, seconds, stream=True, cancelled=cancelled)
+
+        if verbose:
+            print('<' * 80)
+            print(model_output_str)
+
+        return model_output_str
+
+    def _packed_input_str(self, input_problems: list[str]) -> str:
+        model_input = self.prompt.packed_template.format(k=len(input_problems), problems=format_packed_problems(input_problems))
+
+        return f"{self.packed_fs_prefix}{anthropic.HUMAN_PROMPT} {model_input}{anthropic.AI_PROMPT}"
+
+    def predict_packed(self, input_problems: list[str], max_tokens: int = 128, verbose: bool=False) -> str:
+        '''
+        Ask for every problem in one numbered prompt, with max_tokens per problem. None when
+        the prompt has no packed template.
+        '''
+        if self.prompt.packed_template is None:
+            return None
+
+        model_input_str = self._packed_input_str(input_problems)
+
+        if verbose:
+            print('>' * 80)
+            print(model_input_str)
+
+        start = time.perf_counter()
+        model_output = self.key.completions.create(
+            prompt=model_input_str,
+            stop_sequences=[anthropic.HUMAN_PROMPT],
+            model=self.model_name,
+            max_tokens_to_sample=max_tokens * len(input_problems),
+            temperature=0.0
+        )
+        seconds = time.perf_counter() - start
 
         model_output_str = model_output.completion.strip()
 
+        self._record_call(model_input_str, model_output_str, seconds, getattr(model_output, 'usage', None), packed=len(input_problems))
+
         if verbose:
             print('<' * 80)
             print(model_output_str)
 
         return model_output_str
 
+    def parse_packed(self, raw_output: str, k: int) -> list[int]:
+        return self.prompt.packed_parser(raw_output, k)
+
+    def _record_call(self, input_str: str, output_str: str, seconds: float, usage=None, **fields):
+        metrics.observe('model.predict', seconds)
+        metrics.incr('model.calls')
+        metrics.incr('model.input_chars', len(input_str))
+        metrics.incr('model.output_chars', len(output_str))
+
+        # older completions responses carry no token usage
+        tokens = {}
+        if usage is not None:
+            tokens = {'input_tokens': usage.input_tokens, 'output_tokens': usage.output_tokens}
+            metrics.incr('model.input_tokens', usage.input_tokens)
+            metrics.incr('model.output_tokens', usage.output_tokens)
+
+        metrics.event('model_call', model=self.model_name, seconds=seconds, input_chars=len(input_str), output_chars=len(output_str), **tokens, **fields)
+
     def is_correct(self, raw_output: str, answer: int) -> bool:
         return self.prompt.parser(raw_output) == answer
@@ -0,0 +1,165 @@
+import json
+import sqlite3
+import hashlib
+import threading
+
+from .base import Model
+from ..metrics import metrics
+
+
+DEFAULT_API_URL = 'https://api.anthropic.com'
+
+
+class CachedModel(Model):
+    '''
+    Wraps a deterministic Model with a SQLite cache of its predictions.
+
+    Entries are keyed by the model name, server endpoint, prompt template, few-shot
+    example, input and predict kwargs, so changing any of them misses. The database runs
+    in WAL mode with one connection per thread, so it can be shared by threads and processes.
+    '''
+    def __init__(self, model: Model, path: str):
+        self.model = model
+        self.path = path
+
+        self.hits = 0
+        self.misses = 0
+
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS predictions (
+                key TEXT PRIMARY KEY,
+                model_name TEXT,
+                input TEXT,
+                output TEXT
+            )
+        ''')
+        conn.commit()
+
+    @property
+    def transient_errors(self):
+        return self.model.transient_errors
+
+    def _conn(self) -> sqlite3.Connection:
+        if not hasattr(self._local, 'conn'):
+            self._local.conn = sqlite3.connect(self.path, timeout=30)
+        return self._local.conn
+
+    def _model_name(self) -> str:
+        return getattr(self.model, 'model_name', type(self.model).__name__)
+
+    def _key(self, input, kwargs: dict, stream: bool = False) -> str:
+        prompt = getattr(self.model, 'prompt', None)
+
+        key = {
+            'model_name': self._model_name(),
+            'template': getattr(prompt, 'input_template', None),
+            'fs': list(getattr(prompt, 'fs', None) or []),
+            'input': input,
+            # verbose only changes printing
+            'kwargs': {k: v for k, v in kwargs.items() if k != 'verbose'}
+        }
+
+        # answers from a stand-in or local server must not be served as the real API's;
+        # the default API endpoint is left out so existing entries stay valid
+        endpoint = getattr(self.model, 'base_url', None)
+        if endpoint is not None and endpoint != DEFAULT_API_URL:
+            key['endpoint'] = endpoint
+
+        # streamed outputs stop at the answer, so they are cached apart from full ones
+        if stream:
+            key['stream'] = True
+
+        if isinstance(input, list):
+            key['packed_template'] = getattr(prompt, 'packed_template', None)
+            key['packed_fs'] = getattr(prompt, 'packed_fs', None)
+
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def predict(self, input: str, **kwargs) -> str:
+        return self._cached(self.model.predict, input, kwargs)
+
+    def predict_stream(self, input: str, **kwargs) -> str:
+        return self._cached(self.model.predict_stream, input, kwargs, stream=True)
+
+    def predict_batch(self, inputs: list[str], **kwargs) -> list[str]:
+        conn = self._conn()
+        keys = [self._key(input, kwargs) for input in inputs]
+
+        outputs = []
+        for key in keys:
+            row = conn.execute('SELECT output FROM predictions WHERE key = ?', (key,)).fetchone()
+            outputs.append(row[0] if row is not None else None)
+
+        missing = [i for i, output in enumerate(outputs) if output is None]
+
+        with self._stats_lock:
+            self.hits += len(inputs) - len(missing)
+            self.misses += len(missing)
+        metrics.incr('model_cache.hits', len(inputs) - len(missing))
+        metrics.incr('model_cache.misses', len(missing))
+
+        if not missing:
+            return outputs
+
+        # one batch for every miss
+        for i, output in zip(missing, self.model.predict_batch([inputs[i] for i in missing], **kwargs)):
+            outputs[i] = output
+
+        conn.executemany(
+            'INSERT OR REPLACE INTO predictions (key, model_name, input, output) VALUES (?, ?, ?, ?)',
+            [(keys[i], self._model_name(), inputs[i], outputs[i]) for i in missing]
+        )
+        conn.commit()
+
+        return outputs
+
+    def predict_packed(self, inputs: list[str], **kwargs) -> str:
+        # keyed by the list of inputs, so it cannot collide with single predictions
+        return self._cached(self.model.predict_packed, list(inputs), kwargs)
+
+    def parse_packed(self, raw_output: str, k: int) -> list[int]:
+        return self.model.parse_packed(raw_output, k)
+
+    def _cached(self, predict: callable, input, kwargs: dict, stream: bool = False) -> str:
+        key = self._key(input, kwargs, stream)
+        conn = self._conn()
+
+        row = conn.execute('SELECT output FROM predictions WHERE key = ?', (key,)).fetchone()
+        if row is not None:
+            with self._stats_lock:
+                self.hits += 1
+            metrics.incr('model_cache.hits')
+            return row[0]
+
+        output = predict(input, **kwargs)
+        if output is None:
+            # the model cannot pack, nothing to cache
+            return None
+
+        with self._stats_lock:
+            self.misses += 1
+        metrics.incr('model_cache.misses')
+
+        conn.execute(
+            'INSERT OR REPLACE INTO predictions (key, model_name, input, output) VALUES (?, ?, ?, ?)',
+            (key, self._model_name(), input if isinstance(input, str) else json.dumps(input), output)
+        )
+        conn.commit()
+
+        return output
+
+    def is_correct(self, raw_output: str, answer: int) -> bool:
+        return self.model.is_correct(raw_output, answer)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,77 @@
+import time
+import httpx
+
+from .base import Model, pooled_http_client
+from .prompts import get_prompt
+from ..metrics import metrics
+
+
+class LocalBatchModel(Model):
+    '''
+    A model behind a local inference server that completes a batch of prompts per request.
+
+    predict_batch POSTs {'model', 'prompts', 'max_tokens'} to base_url/v1/batch and expects
+    {'completions': [...]} back in the same order, so a whole pull is one round trip. See
+    experiments/stream_server.py for a stand-in server.
+    '''
+    transient_errors = (httpx.TransportError, ConnectionError, TimeoutError)
+
+    def __init__(
+            self,
+            base_url: str,
+            model_name: str = 'local',
+            prompt=get_prompt('basic_cot'),
+            timeout: float = 600.0,
+            max_connections: int = 16
+        ):
+        self.base_url = base_url.rstrip('/')
+        self.model_name = model_name
+        self.prompt = prompt
+        self.timeout = timeout
+
+        self.client = pooled_http_client(max_connections)
+
+        fs_example = self.prompt.fs
+        self.fs_prefix = f'{self.prompt.input_template.format(problem=fs_example[0])}\n{fs_example[1]}\n\n'
+
+    def _input_str(self, input_problem: str) -> str:
+        return f'{self.fs_prefix}{self.prompt.input_template.format(problem=input_problem)}\n'
+
+    def predict(self, input_problem: str, max_tokens: int = 128, verbose: bool = False) -> str:
+        return self.predict_batch([input_problem], max_tokens=max_tokens, verbose=verbose)[0]
+
+    def predict_batch(self, input_problems: list[str], max_tokens: int = 128, verbose: bool = False) -> list[str]:
+        model_input_strs = [self._input_str(input_problem) for input_problem in input_problems]
+
+        if verbose:
+            for model_input_str in model_input_strs:
+                print('>' * 80)
+                print(model_input_str)
+
+        start = time.perf_counter()
+        response = self.client.post(
+            f'{self.base_url}/v1/batch',
+            json={'model': self.model_name, 'prompts': model_input_strs, 'max_tokens': max_tokens},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        seconds = time.perf_counter() - start
+
+        model_output_strs = [completion.strip() for completion in response.json()['completions']]
+        if len(model_output_strs) != len(input_problems):
+            raise ValueError(f'Expected {len(input_problems)} completions, got {len(model_output_strs)}')
+
+        metrics.observe('model.predict_batch', seconds)
+        metrics.incr('model.calls')
+        metrics.incr('model.batched_inputs', len(input_problems))
+        metrics.event('model_call', model=self.model_name, seconds=seconds, batch=len(input_problems))
+
+        if verbose:
+            for model_output_str in model_output_strs:
+                print('<' * 80)
+                print(model_output_str)
+
+        return model_output_strs
+
+    def is_correct(self, raw_output: str, answer: int) -> bool:
+        return self.prompt.parser(raw_output) == answer
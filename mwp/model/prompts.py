@@ -25,16 +25,81 @@ def basic_cot_prompt_parse(raw_output):
 
     return val
 
+def basic_cot_prompt_stream_parse(partial_output):
+    match = re.search(r'answer is', partial_output, re.S)
+    if not match:
+        return None
+
+    # the answer sentence ends at a line break, or at a period not inside a number
+    rest = partial_output[match.end():]
+    end = re.search(r'\n|[.!?](?=\s)', rest)
+    if not end:
+        return None
+
+    # only final if the sentence ends on its number: "3 + 4 = 7." is read to the 7, and
+    # "15 dollars." is left to the full output
+    sentence = rest[:end.start()]
+    if not re.search(r'\d\s*$', sentence):
+        return None
+
+    return basic_cot_prompt_parse(partial_output[:match.end() + end.start()])
+
+
+basic_cot_packed_prompt = """The following are {k} math word problems:
+{problems}
+
+Solve each problem in order. Explain your reasoning step by step, then write its final answer on its own line as "Answer <problem number>: <answer>"."""
+
+basic_cot_packed_prompt_fs = (
+    (
+        "There are 15 trees in the grove. Grove workers will plant trees in the grove today. After they are done, there will be 21 trees. How many trees did the grove workers plant today?",
+        "If there are 3 cars in the parking lot and 2 more cars arrive, how many cars are in the parking lot?"
+    ),
+    "Problem 1: There are 15 trees originally. Then there were 21 trees after some more were planted. So there must have been 21 - 15 = 6.\nAnswer 1: 6\nProblem 2: There are originally 3 cars. 2 more cars arrive. 3 + 2 = 5.\nAnswer 2: 5"
+)
+
+def basic_cot_packed_prompt_parse(raw_output, k):
+    vals = [None] * k
+
+    for idx, answer in re.findall(r'Answer (\d+):([^\n]*)', raw_output):
+        idx = int(idx) - 1
+        match = re.findall(r'\d+', answer)
+        # the first answer given for a problem counts
+        if 0 <= idx < k and vals[idx] is None and match:
+            vals[idx] = int(match[-1])
+
+    return vals
+
+def format_packed_problems(problems):
+    return '\n'.join(f'Problem {i + 1}: {problem}' for i, problem in enumerate(problems))
+
 
 @dataclass
 class Prompt:
     input_template: str
     fs: tuple[str]
     parser: callable = basic_cot_prompt_parse
+    # parses a partial output, returning None until the final answer is complete. It should
+    # agree with parser whenever the output ends with its answer, but cannot see numbers
+    # written after the point where it cancels, where parser may pick a different one
+    stream_parser: callable = None
+    # several problems in one request: the template takes k and the numbered problems, the
+    # few-shot example is (problems, output), and the parser returns k answers or None each
+    packed_template: str = None
+    packed_fs: tuple = None
+    packed_parser: callable = None
 
 
 PROMPTS = {
-    'basic_cot': Prompt(basic_cot_prompt, basic_cot_prompt_fs, basic_cot_prompt_parse),
+    'basic_cot': Prompt(
+        basic_cot_prompt,
+        basic_cot_prompt_fs,
+        basic_cot_prompt_parse,
+        basic_cot_prompt_stream_parse,
+        basic_cot_packed_prompt,
+        basic_cot_packed_prompt_fs,
+        basic_cot_packed_prompt_parse
+    ),
 }
 
 def get_prompt(prompt_name: str) -> Prompt:
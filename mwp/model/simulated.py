@@ -0,0 +1,114 @@
+import time
+import math
+import random
+import pandas as pd
+
+from .base import Model
+from .prompts import get_prompt
+from ..trees.features import tree_features
+
+
+class SimulatedModel(Model):
+    '''
+    An offline stand-in for an LLM, for benchmarking and testing the search loop.
+
+    Problems are looked up by input text in a build_dataset DataFrame. The answer is the
+    row's target_val, except with probability error_rate(tree): the log-odds of an error
+    are logit(base_error) plus error_rules[feature] for each occurrence of a tree feature
+    (see mwp.trees.features), e.g. {'op:+>+': 1.0} makes consecutive additions harder.
+    A base_error of 0 or 1 makes a model that is always or never right, whatever the rules.
+    Each call sleeps latency seconds plus up to latency_jitter more, and a batched or
+    packed call answers all its problems for the latency of one.
+    '''
+    def __init__(
+            self,
+            problems: pd.DataFrame,
+            error_rules: dict[str, float] = None,
+            base_error: float = 0.05,
+            latency: float = 0.0,
+            latency_jitter: float = 0.0,
+            prompt=get_prompt('basic_cot'),
+            seed: int = None
+        ):
+        self.model_name = 'simulated'
+        self.prompt = prompt
+
+        if not 0 <= base_error <= 1:
+            raise ValueError(f'base_error must be in [0, 1], got {base_error}')
+
+        self.error_rules = error_rules or {}
+        self.base_error = base_error
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+
+        # private RNG, so simulated calls leave the global random state alone
+        self.rng = random.Random(seed)
+
+        self.answers = {}
+        self.error_rates = {}
+        for expr, tree, problem, question, target_val in zip(
+                problems['expression'], problems['tree'], problems['problem'], problems['question'], problems['target_val']
+            ):
+            expr_s = str(expr)
+            if expr_s not in self.error_rates:
+                self.error_rates[expr_s] = self.error_rate(tree[0])
+
+            self.answers[f'{problem} {question}'] = (int(target_val), self.error_rates[expr_s])
+
+    def error_rate(self, tree) -> float:
+        # a certain base rate has infinite log-odds, which no rule can move
+        if self.base_error in (0, 1):
+            return float(self.base_error)
+
+        features = tree_features(tree)
+        log_odds = math.log(self.base_error / (1 - self.base_error))
+        log_odds += sum(weight * features.get(name, 0) for name, weight in self.error_rules.items())
+
+        # written so large rule weights cannot overflow exp
+        if log_odds >= 0:
+            return 1 / (1 + math.exp(-log_odds))
+        return math.exp(log_odds) / (1 + math.exp(log_odds))
+
+    def _sleep(self):
+        if self.latency or self.latency_jitter:
+            time.sleep(self.latency + self.rng.random() * self.latency_jitter)
+
+    def _answer(self, input_problem: str) -> int:
+        if input_problem not in self.answers:
+            raise ValueError('Unknown problem')
+
+        target_val, error_rate = self.answers[input_problem]
+
+        answer = target_val
+        if self.rng.random() < error_rate:
+            answer = abs(target_val + self.rng.choice([-1, 1]) * self.rng.randint(1, 10))
+            if answer == target_val:
+                answer += 1
+
+        return answer
+
+    def predict(self, input_problem: str, max_tokens: int = 128, verbose: bool = False) -> str:
+        self._sleep()
+
+        return f'Working through the problem step by step. The answer is {self._answer(input_problem)}'
+
+    def predict_batch(self, input_problems: list[str], max_tokens: int = 128, verbose: bool = False) -> list[str]:
+        # a batch-native backend: one request's latency for the whole batch
+        self._sleep()
+
+        return [f'Working through the problem step by step. The answer is {self._answer(input_problem)}' for input_problem in input_problems]
+
+    def predict_packed(self, input_problems: list[str], max_tokens: int = 128, verbose: bool = False) -> str:
+        # one request's latency for the whole pack
+        self._sleep()
+
+        return '\n'.join(
+            f'Problem {i + 1}: working through it step by step.\nAnswer {i + 1}: {self._answer(input_problem)}'
+            for i, input_problem in enumerate(input_problems)
+        )
+
+    def parse_packed(self, raw_output: str, k: int) -> list[int]:
+        return self.prompt.packed_parser(raw_output, k)
+
+    def is_correct(self, raw_output: str, answer: int) -> bool:
+        return self.prompt.parser(raw_output) == answer
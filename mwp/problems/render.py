@@ -0,0 +1,173 @@
+import string
+import numpy as np
+
+
+_formatter = string.Formatter()
+
+
+def _escape(text: str) -> str:
+    return text.replace('{', '{{').replace('}', '}}')
+
+def _field(idx: int, conversion, format_spec) -> str:
+    field = '{' + str(idx)
+    if conversion:
+        field += '!' + conversion
+    if format_spec:
+        field += ':' + format_spec
+    return field + '}'
+
+
+class RenderPlan():
+    '''
+    A tree structure compiled into flat format strings for the problem text and question.
+
+    Positional slots 0..n_leaves-1 hold the leaf values, and the remaining slots hold the
+    entity (name, job, ...) picked for a given operation. Like BinaryOperation, every
+    operation picks a distinct value for every constant.
+    '''
+    def __init__(
+            self,
+            problem_fmt: str,
+            question_fmt: str,
+            n_leaves: int,
+            n_ops: int,
+            entity_slots: list[tuple[str, int]],
+            constants: dict[str, list[str]]
+        ):
+        self.problem_fmt = problem_fmt
+        self.question_fmt = question_fmt
+        self.n_leaves = n_leaves
+        self.n_ops = n_ops
+        self.entity_slots = entity_slots
+        self.constants = constants
+
+    @classmethod
+    def compile(cls, shape: list, problem: dict) -> 'RenderPlan':
+        '''
+        Compile a tree_template shape (leaves as ['NUM', leaf_idx]) for a problem spec.
+        '''
+        # templates are expanded into lists of literal strings and (slot, conversion, format_spec)
+        utts = []
+        n_leaves = [0]
+
+        def _expand(template, fields):
+            parts = []
+            for literal, field_name, format_spec, conversion in _formatter.parse(template):
+                if literal:
+                    parts.append(literal)
+                if field_name is not None:
+                    parts.extend(fields(field_name, conversion, format_spec))
+            return parts
+
+        def _compile(node):
+            # returns (is_constant, leaf slot or the parts of the operation's id_utt)
+            if not isinstance(node[1], list):
+                assert node[0] == 'NUM', node[0]
+                n_leaves[0] += 1
+                return True, ('leaf', node[1])
+
+            op = node[0]
+            if op not in problem['operations']:
+                raise ValueError(f'Unknown operation: {op}')
+
+            children = [_compile(child) for child in node[1]]
+
+            op_idx = len(utts)
+            templates = problem['operations'][op]['templates']
+            units = problem['operations'][op]['units']
+
+            def _fields(field_name, conversion, format_spec):
+                if field_name in ('arg0', 'arg1'):
+                    is_constant, child = children[int(field_name[-1])]
+                    if is_constant:
+                        # same as Value.get_value_units: constants are wrapped in their units
+                        return _expand(units[field_name], lambda _, conv, spec: [(child, conv, spec)])
+                    return child
+
+                return [(('entity', field_name, op_idx), conversion, format_spec)]
+
+            utts.append(_expand(templates['utt'], _fields))
+
+            return False, _expand(templates['id_utt'], _fields)
+
+        is_constant, root = _compile(shape)
+        root_parts = [(root, None, '')] if is_constant else root
+
+        problem_parts = []
+        for i, utt in enumerate(utts):
+            if i > 0:
+                problem_parts.append(' ')
+            problem_parts.extend(utt)
+
+        def _question_fields(field_name, conversion, format_spec):
+            if field_name != 'query':
+                raise KeyError(field_name)
+            return root_parts
+
+        question_parts = _expand(problem['question'], _question_fields)
+
+        # leaves take the first positional slots, entities follow in order of appearance
+        n_leaves = n_leaves[0]
+
+        entity_slots = []
+        for part in problem_parts + question_parts:
+            if not isinstance(part, str) and part[0][0] == 'entity' and part[0][1:] not in entity_slots:
+                entity_slots.append(part[0][1:])
+
+        slot_idx = {('leaf', i): i for i in range(n_leaves)}
+        for i, entity in enumerate(entity_slots):
+            slot_idx[('entity',) + entity] = n_leaves + i
+
+        def _join(parts):
+            return ''.join(
+                _escape(part) if isinstance(part, str) else _field(slot_idx[part[0]], part[1], part[2])
+                for part in parts
+            )
+
+        return cls(
+            _join(problem_parts),
+            _join(question_parts),
+            n_leaves,
+            len(utts),
+            entity_slots,
+            problem['constants']
+        )
+
+    def pick_entities(self, n: int) -> dict[str, np.ndarray]:
+        '''
+        For each constant, draw n rows of distinct values, one per operation.
+        '''
+        used_keys = set(key for key, _ in self.entity_slots)
+
+        picks = {}
+        for key, values in self.constants.items():
+            if self.n_ops > len(values):
+                raise ValueError('No more values to pick from')
+
+            if key not in used_keys:
+                continue
+
+            # argsort of iid uniforms is a uniformly random permutation per row
+            order = np.argsort(np.random.random((n, len(values))), axis=1)[:, :self.n_ops]
+            picks[key] = np.array(values, dtype=object)[order]
+
+        return picks
+
+    def render(self, leaf_vals: np.ndarray) -> tuple[list[str], list[str]]:
+        '''
+        Render problem texts and questions for an (n_samples, n_leaves) array of leaf values.
+        '''
+        leaf_vals = np.asarray(leaf_vals).reshape(-1, self.n_leaves)
+        n = len(leaf_vals)
+
+        picks = self.pick_entities(n)
+
+        columns = [col.tolist() for col in leaf_vals.T]
+        columns += [picks[key][:, op_idx].tolist() for key, op_idx in self.entity_slots]
+
+        rows = list(zip(*columns)) if columns else [()] * n
+
+        problems = [self.problem_fmt.format(*row) for row in rows]
+        questions = [self.question_fmt.format(*row) for row in rows]
+
+        return problems, questions
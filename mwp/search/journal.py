@@ -0,0 +1,75 @@
+import os
+import json
+import random
+import numpy as np
+
+
+def get_rng_state() -> dict:
+    np_state = np.random.get_state()
+    py_state = random.getstate()
+
+    return {
+        'numpy': [np_state[0], np_state[1].tolist(), np_state[2], np_state[3], np_state[4]],
+        'python': [py_state[0], list(py_state[1]), py_state[2]]
+    }
+
+def set_rng_state(state: dict):
+    np_state = state['numpy']
+    np.random.set_state((np_state[0], np.array(np_state[1], dtype=np.uint32), np_state[2], np_state[3], np_state[4]))
+
+    py_state = state['python']
+    random.setstate((py_state[0], tuple(py_state[1]), py_state[2]))
+
+def _json_default(obj):
+    # row indices and rewards are often numpy scalars
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f'Cannot serialize {type(obj)}')
+
+
+class Journal():
+    '''
+    Append-only JSONL log of an optimizer run, flushed to disk after every record.
+
+    The first record holds the run config and the starting RNG state. Every pull then adds
+    a record with its round, arm, reward, logs, the arm's ProblemSpace state and the RNG state.
+    '''
+    def __init__(self, path: str):
+        self.path = path
+        self.file = None
+
+    def read(self) -> list[dict]:
+        if not os.path.exists(self.path):
+            return []
+
+        records = []
+        good_bytes = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    break
+                good_bytes += len(line)
+
+        # drop a torn final line from a crash mid-write so appends start on a clean line
+        if good_bytes < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as f:
+                f.truncate(good_bytes)
+
+        return records
+
+    def append(self, record: dict):
+        if self.file is None:
+            self.file = open(self.path, 'a')
+
+        self.file.write(json.dumps(record, default=_json_default) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -1,51 +1,267 @@
+import numpy as np
 import pandas as pd
+from collections import OrderedDict
+
+from ..trees.canonical import canonical_expr
+from ..trees.utils import random_sample
 
 
 class ProblemSpace():
-    def __init__(self, problems: pd.DataFrame, replace: bool = False):
+    def __init__(self, problems: pd.DataFrame, replace: bool = False, canonical: bool = False):
         self.problems = problems
         self.replace = replace
+        self.canonical = canonical
 
         if not self.replace:
             self.picked_map = {}
 
-        self.problems['expression_str'] = self.problems['expression'].apply(lambda x: str(x))
-        
-        self.arms = self.problems['expression_str'].unique()
+        # load_dataset already provides expression_str as a categorical
+        if 'expression_str' not in self.problems:
+            self.problems['expression_str'] = self.problems['expression'].apply(lambda x: str(x))
+
+        if self.canonical:
+            # expressions that only differ in commutative argument order share an arm
+            canonical_map = {}
+            for expr_s, tree in zip(self.problems['expression_str'], self.problems['tree']):
+                if expr_s not in canonical_map:
+                    canonical_map[expr_s] = str(canonical_expr(tree[0]))
+
+            self.problems['arm_str'] = self.problems['expression_str'].map(canonical_map)
+        else:
+            self.problems['arm_str'] = self.problems['expression_str']
+
+        # positional index: rows of arm i are arm_rows[arm_offsets[i]:arm_offsets[i + 1]]
+        arm_codes, arms = pd.factorize(self.problems['arm_str'])
+        self.arms = np.asarray(arms, dtype=object)
+        self.arm_codes = arm_codes
+
+        self.arm_rows = np.argsort(arm_codes, kind='stable')
+        self.arm_offsets = np.zeros(len(self.arms) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(arm_codes, minlength=len(self.arms)), out=self.arm_offsets[1:])
+
+        # rows left to sample per arm
+        self.remaining = np.diff(self.arm_offsets)
 
         print(f'num arms: {len(self.arms)}')
 
-        self.problem_map = {}
-        for tree_s in self.arms:
-            problem_rows = self.problems[self.problems['expression_str'] == tree_s]
+        # canonical arm -> original expressions it covers
+        self.arm_expressions = {
+            arm: list(exprs.unique())
+            for arm, exprs in self.problems.groupby('arm_str', sort=False, observed=True)['expression_str']
+        }
+
+        if not self.replace:
+            # each arm is shuffled once on its first pull, then read through with a cursor
+            self.arm_order = {}
+
+    def _arm_rows(self, arm_idx: int) -> np.ndarray:
+        return self.arm_rows[self.arm_offsets[arm_idx]:self.arm_offsets[arm_idx + 1]]
 
-            self.problem_map[tree_s] = problem_rows
+    def arm_tree(self, arm_idx: int):
+        '''
+        Parse tree of an arm (of its first row, for canonical arms).
+        '''
+        return self.problems['tree'].iloc[self.arm_rows[self.arm_offsets[arm_idx]]][0]
 
     def can_sample(self, arm_idx: int, n: int) -> bool:
-        arm = self.arms[arm_idx]
-        
+        return self.remaining[arm_idx] >= n
+
+    def sampleable_arms(self, n: int) -> np.ndarray:
+        '''
+        Boolean mask of the arms that can still be sampled n at a time.
+        '''
+        return self.remaining >= n
+
+    def sample_arm(self, arm_idx: int, n: int) -> pd.DataFrame:
+        rows = self._arm_rows(arm_idx)
+
         if self.replace:
-            return len(self.problem_map[arm]) >= n
+            return self.problems.iloc[rows[np.random.randint(0, len(rows), n)]]
+        else:
+            if not self.can_sample(arm_idx, n):
+                raise ValueError(f'Arm {arm_idx} has only {self.remaining[arm_idx]} problems left')
+
+            if arm_idx not in self.arm_order:
+                self.arm_order[arm_idx] = np.random.permutation(rows)
+                self.picked_map[arm_idx] = 0
+
+            cursor = self.picked_map[arm_idx]
+            self.picked_map[arm_idx] = cursor + n
+            self.remaining[arm_idx] -= n
+
+            return self.problems.iloc[self.arm_order[arm_idx][cursor:cursor + n]]
+
+    def arm_state(self, arm_idx: int) -> dict:
+        '''
+        JSON-serializable sampling state of an arm, for optimizer journals.
+        '''
+        if self.replace or arm_idx not in self.arm_order:
+            return {}
+
+        return {'order': self.arm_order[arm_idx].tolist(), 'cursor': self.picked_map[arm_idx]}
+
+    def restore_arm_state(self, arm_idx: int, state: dict):
+        if not state:
+            return
+
+        self.arm_order[arm_idx] = np.array(state['order'])
+        self.picked_map[arm_idx] = state['cursor']
+        self.remaining[arm_idx] = len(self._arm_rows(arm_idx)) - state['cursor']
+
+    def num_arms(self) -> int:
+        return len(self.arms)
+
+
+class LazyProblemSpace():
+    '''
+    A ProblemSpace over the trees of a ProblemBuilder that generates an arm's n_samples
+    problems the first time it is pulled, instead of building the whole dataset up front.
+
+    Each arm's pool is generated from its own seed, so an arm evicted from the bounded
+    cache (max_cached_arms) is regenerated identically and no-replacement sampling stays exact.
+    Canonical arms need the canonical trees enumerated at startup; other arms are unranked
+    on demand.
+    '''
+    def __init__(
+            self,
+            builder,
+            max_depth: int,
+            n_samples: int = 100,
+            min_depth: int = 0,
+            replace: bool = False,
+            canonical: bool = False,
+            subsample: int = None,
+            max_cached_arms: int = None,
+            seed: int = 0
+        ):
+        self.builder = builder
+        self.max_depth = max_depth
+        self.min_depth = min_depth
+        self.n_samples = n_samples
+        self.replace = replace
+        self.canonical = canonical
+        if max_cached_arms is not None and max_cached_arms < 0:
+            raise ValueError(f'max_cached_arms must be non-negative, got {max_cached_arms}')
+
+        self.max_cached_arms = max_cached_arms
+        self.seed = seed
+
+        if self.canonical:
+            exprs, trees = builder.get_trees(max_depth, min_depth=min_depth, canonical=True)
+            if subsample is not None:
+                exprs, trees = random_sample(subsample, exprs, trees)
+            self.arm_trees = dict(enumerate(zip(exprs, trees)))
+            self.ranks = None
+            self._num_arms = len(self.arm_trees)
         else:
-            if arm not in self.picked_map:
-                self.picked_map[arm] = []
+            # arms are tree ranks, unranked the first time they are needed
+            self.arm_trees = {}
+            if subsample is not None:
+                self.ranks = builder.counter.sample_ranks(subsample, max_depth, min_depth=min_depth)
+            else:
+                self.ranks = range(builder.count_trees(max_depth, min_depth=min_depth))
+            self._num_arms = len(self.ranks)
 
-            return len(self.problem_map[arm]) - len(self.picked_map[arm]) >= n
+        print(f'num arms: {self._num_arms}')
+
+        self.problem_map = OrderedDict()
+        self.num_generated = 0
+
+        if not self.replace:
+            self.picked_map = {}
+
+    def _arm_expr_tree(self, arm_idx: int) -> tuple[list, list]:
+        if arm_idx not in self.arm_trees:
+            self.arm_trees[arm_idx] = self.builder.counter.unrank(
+                self.ranks[arm_idx], self.max_depth, min_depth=self.min_depth
+            )
+
+        return self.arm_trees[arm_idx]
+
+    def arm_tree(self, arm_idx: int):
+        return self._arm_expr_tree(arm_idx)[1][0]
+
+    def _generate(self, arm_idx: int) -> pd.DataFrame:
+        expr, tree = self._arm_expr_tree(arm_idx)
+
+        # seed per arm without disturbing the caller's random state
+        state = np.random.get_state()
+        np.random.seed((self.seed + arm_idx) % 2**32)
+        try:
+            rows, _ = self.builder.build_rows([(expr, tree)], self.n_samples, batch=True, pbar=False)
+        finally:
+            np.random.set_state(state)
+
+        # row ids are unique across arms
+        problems = pd.DataFrame(rows, index=arm_idx * self.n_samples + np.arange(len(rows)))
+        problems['expression_str'] = str(expr)
+        problems['arm_str'] = str(canonical_expr(tree[0])) if self.canonical else str(expr)
+
+        self.num_generated += 1
+
+        return problems
+
+    def _get_problems(self, arm_idx: int) -> pd.DataFrame:
+        if arm_idx in self.problem_map:
+            self.problem_map.move_to_end(arm_idx)
+            return self.problem_map[arm_idx]
+
+        # with max_cached_arms=0 nothing is kept, and the new arm is evicted right away
+        problems = self._generate(arm_idx)
+        self.problem_map[arm_idx] = problems
+
+        if self.max_cached_arms is not None:
+            while len(self.problem_map) > self.max_cached_arms:
+                self.problem_map.popitem(last=False)
+
+        return problems
+
+    def can_sample(self, arm_idx: int, n: int) -> bool:
+        if self.replace:
+            return self.n_samples >= n
+        else:
+            return self.n_samples - self.picked_map.get(arm_idx, 0) >= n
+
+    def sampleable_arms(self, n: int) -> np.ndarray:
+        '''
+        Boolean mask of the arms that can still be sampled n at a time.
+        '''
+        mask = np.full(self._num_arms, self.n_samples >= n)
+        if not self.replace:
+            for arm_idx, picked in self.picked_map.items():
+                mask[arm_idx] = self.n_samples - picked >= n
+
+        return mask
 
     def sample_arm(self, arm_idx: int, n: int) -> pd.DataFrame:
-        arm = self.arms[arm_idx]
-        
+        problems = self._get_problems(arm_idx)
+
         if self.replace:
-            return self.problem_map[arm].sample(n, replace=True)
+            return problems.sample(n, replace=True)
         else:
-            if arm not in self.picked_map:
-                self.picked_map[arm] = []
+            # rows are iid draws, so taking them in order samples without replacement
+            cursor = self.picked_map.get(arm_idx, 0)
+            if cursor + n > len(problems):
+                raise ValueError(f'Arm {arm_idx} has only {len(problems) - cursor} problems left')
+
+            self.picked_map[arm_idx] = cursor + n
 
-            sampled = self.problem_map[arm].drop(self.picked_map[arm]).sample(n, replace=False)
+            return problems.iloc[cursor:cursor + n]
+
+    def arm_state(self, arm_idx: int) -> dict:
+        '''
+        JSON-serializable sampling state of an arm, for optimizer journals.
+        '''
+        if self.replace:
+            return {}
 
-            self.picked_map[arm] += list(sampled.index)
+        return {'cursor': self.picked_map.get(arm_idx, 0)}
+
+    def restore_arm_state(self, arm_idx: int, state: dict):
+        if not state:
+            return
+
+        self.picked_map[arm_idx] = state['cursor']
 
-            return sampled
-    
     def num_arms(self) -> int:
-        return len(self.arms)
+        return self._num_arms
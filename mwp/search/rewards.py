@@ -1,29 +1,211 @@
+import time
+import threading
 import pandas as pd
 from typing import Callable, Any
+from concurrent.futures import ThreadPoolExecutor
 
 from ..model import Model
+from ..metrics import metrics
 
 
-def make_model_reward(model: Model, **kwargs) -> Callable[[pd.DataFrame], int]:
+def _pack_groups(n: int, pack: int) -> list[range]:
+    if pack is None or pack <= 1:
+        return []
+    return [range(start, min(start + pack, n)) for start in range(0, n, pack)]
+
+def _read_pack(model: Model, raw_output: str, group: range, input_strs: list[str], index: list, target_vals: list) -> dict[int, tuple[bool, dict]]:
+    '''
+    Correctness and log entry of each problem in a packed output whose answer parsed, keyed
+    by row position. Missing positions must fall back to single predictions.
+    '''
+    metrics.incr('reward.packed_requests')
+    answers = model.parse_packed(raw_output, len(group)) if raw_output is not None else [None] * len(group)
+
+    results = {}
+    for pos, (i, answer) in enumerate(zip(group, answers)):
+        if answer is None:
+            metrics.incr('reward.pack_fallbacks')
+            continue
+
+        results[i] = (answer == target_vals[i], {
+            'index': index[i],
+            'input_str': input_strs[i],
+            'raw_output': raw_output,
+            'pack_position': pos
+        })
+
+    return results
+
+
+def make_model_reward(model: Model, stream: bool = False, pack: int = None, **kwargs) -> Callable[[pd.DataFrame], int]:
+    '''
+    Reward of a batch of samples: the number the model answers correctly, and a log entry
+    per sample. Predictions go through model.predict_batch, so batching backends answer a
+    pull in one round trip; with stream they are made one at a time by predict_stream. With
+    pack > 1, problems are asked pack at a time through predict_packed, and any whose answer
+    fails to parse (every one, for a model that cannot pack) is asked again on its own.
+    '''
+    def reward_func(samples: pd.DataFrame) -> tuple[int, list[Any]]:
+        input_strs = [f'{problem} {question}' for problem, question in zip(samples['problem'], samples['question'])]
+        index, target_vals = list(samples.index), list(samples['target_val'])
+
+        results = {}
+        for group in _pack_groups(len(input_strs), pack):
+            raw_output = model.predict_packed([input_strs[i] for i in group], **kwargs)
+            results.update(_read_pack(model, raw_output, group, input_strs, index, target_vals))
+
+        single = [i for i in range(len(input_strs)) if i not in results]
+        if stream:
+            single_outputs = [model.predict_stream(input_strs[i], **kwargs) for i in single]
+        elif single:
+            single_outputs = model.predict_batch([input_strs[i] for i in single], **kwargs)
+        else:
+            single_outputs = []
+
+        for i, raw_output in zip(single, single_outputs):
+            results[i] = (model.is_correct(raw_output, target_vals[i]), {
+                'index': index[i],
+                'input_str': input_strs[i],
+                'raw_output': raw_output
+            })
+
+        correct = 0
+
+        raw_outputs = []
+
+        for i in range(len(input_strs)):
+            is_correct, log = results[i]
+
+            if is_correct:
+                correct += 1
+
+            raw_outputs.append(log)
+
+        return correct, raw_outputs
+
+    return reward_func
+
+
+class TokenBucket():
+    '''
+    Thread-safe token bucket allowing rate acquisitions per second, with bursts of up to capacity.
+    '''
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+
+                wait = (1 - self.tokens) / self.rate
+
+            time.sleep(wait)
+
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+def shared_executor(max_workers: int) -> ThreadPoolExecutor:
+    '''
+    A thread pool shared by every caller asking for the same size, so reward functions
+    made once per run do not each leave a pool behind.
+    '''
+    with _executors_lock:
+        if max_workers not in _executors:
+            _executors[max_workers] = ThreadPoolExecutor(max_workers=max_workers)
+        return _executors[max_workers]
+
+
+def make_concurrent_model_reward(
+        model: Model,
+        max_concurrency: int = 8,
+        rate_limit: float = None,
+        max_retries: int = 3,
+        backoff: float = 1.0,
+        retry_on: tuple = None,
+        stream: bool = False,
+        pack: int = None,
+        executor: ThreadPoolExecutor = None,
+        **kwargs
+    ) -> Callable[[pd.DataFrame], int]:
+    '''
+    Like make_model_reward, but the predictions of a batch are issued concurrently.
+
+    Predictions run on executor, by default a pool shared with every reward function of
+    the same max_concurrency, so at most that many run at once across all of them, and at
+    most rate_limit start per second. Errors in retry_on (the model's transient_errors by
+    default) are retried up to max_retries times, waiting backoff * 2^attempt seconds in
+    between. Logs keep the row order of samples. With
+    stream, predictions use model.predict_stream and stop once the answer is parsed.
+    Packed requests run concurrently first, then the fallbacks of their failed answers.
+    '''
+    executor = executor if executor is not None else shared_executor(max_concurrency)
+    bucket = TokenBucket(rate_limit) if rate_limit is not None else None
+    retry_on = retry_on if retry_on is not None else model.transient_errors
+    model_predict = model.predict_stream if stream else model.predict
+
+    def call(predict_fn: Callable, model_input) -> str:
+        for attempt in range(max_retries + 1):
+            if bucket is not None:
+                bucket.acquire()
+
+            try:
+                return predict_fn(model_input, **kwargs)
+            except retry_on:
+                if attempt == max_retries:
+                    raise
+
+            time.sleep(backoff * 2 ** attempt)
+
     def reward_func(samples: pd.DataFrame) -> tuple[int, list[Any]]:
+        input_strs = [f'{problem} {question}' for problem, question in zip(samples['problem'], samples['question'])]
+        index, target_vals = list(samples.index), list(samples['target_val'])
+
+        groups = _pack_groups(len(input_strs), pack)
+        packed_futures = [executor.submit(call, model.predict_packed, [input_strs[i] for i in group]) for group in groups]
+
+        results = {}
+        for group, future in zip(groups, packed_futures):
+            results.update(_read_pack(model, future.result(), group, input_strs, index, target_vals))
+
+        futures = {
+            i: executor.submit(call, model_predict, input_str)
+            for i, input_str in enumerate(input_strs) if i not in results
+        }
+
         correct = 0
 
         raw_outputs = []
 
-        for _, row in samples.iterrows():
-            input_str = f'{row["problem"]} {row["question"]}'
-            target_val = row['target_val']
+        for i, (input_str, target_val) in enumerate(zip(input_strs, target_vals)):
+            if i in results:
+                is_correct, log = results[i]
+            else:
+                raw_output = futures[i].result()
+                is_correct = model.is_correct(raw_output, target_val)
 
-            raw_output = model.predict(input_str, **kwargs)
+                log = {
+                    'index': index[i],
+                    'input_str': input_str,
+                    'raw_output': raw_output
+                }
 
-            if model.is_correct(raw_output, target_val):
+            if is_correct:
                 correct += 1
-            
-            raw_outputs.append({
-                'index': row.name,
-                'input_str': input_str,
-                'raw_output': raw_output
-            })
+
+            raw_outputs.append(log)
 
         return correct, raw_outputs
 
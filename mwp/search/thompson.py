@@ -1,10 +1,19 @@
+import time
 import pandas as pd
 import numpy as np
 from typing import Callable
 from numpy.typing import ArrayLike
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
 from .problems import ProblemSpace
+from .journal import Journal, get_rng_state, set_rng_state
+from ..trees.features import feature_matrix
+from ..metrics import metrics
+
+
+def _sigmoid(z):
+    return np.exp(-np.logaddexp(0, -z))
 
 
 class Optimizer():
@@ -31,6 +40,87 @@ class Optimizer():
     
     def get_logs(self) -> list:
         return self.pull_logs
+
+    def _apply_pull(self, arm_idx: int, reward: int, n: int, log_data: list):
+        self.pull_logs[arm_idx].extend(log_data)
+
+        self.successes[arm_idx] += reward
+        self.pulls[arm_idx] += n
+
+    def _reward(self, samples: pd.DataFrame) -> tuple[int, list]:
+        start = time.perf_counter()
+        reward, log_data = self.reward_func(samples)
+        seconds = time.perf_counter() - start
+
+        metrics.observe('search.reward', seconds)
+        metrics.incr('search.pulls')
+        metrics.incr('search.samples', len(samples))
+        metrics.event('pull', samples=len(samples), reward=reward, seconds=seconds)
+
+        return reward, log_data
+
+    def _open_journal(self, journal: str, config: dict) -> tuple[list[dict], dict[int, dict]]:
+        '''
+        Replay the complete rounds of a journal into the optimizer, the problem space and the
+        RNGs. Returns the replayed pull records, and the already finished pulls of an
+        interrupted round keyed by arm.
+        '''
+        self.journal = Journal(journal) if journal else None
+        if self.journal is None:
+            return [], {}
+
+        records = self.journal.read()
+        if not records:
+            self.journal.append({'config': config, 'rng': get_rng_state()})
+            return [], {}
+
+        if records[0]['config'] != config:
+            raise ValueError(f'{journal} was written by a different run: {records[0]["config"]}')
+
+        set_rng_state(records[0]['rng'])
+
+        pull_records = records[1:]
+
+        replayed = []
+        pending = {}
+        while len(replayed) < len(pull_records):
+            round_idx = pull_records[len(replayed)]['round']
+            round_records = [r for r in pull_records[len(replayed):] if r['round'] == round_idx]
+
+            if len(round_records) < round_records[0]['round_size']:
+                pending = {r['arm']: r for r in round_records}
+                break
+
+            for r in round_records:
+                self._apply_pull(r['arm'], r['reward'], r['n'], r['logs'])
+                self.problems.restore_arm_state(r['arm'], r['arm_state'])
+
+            set_rng_state(round_records[-1]['rng'])
+            replayed.extend(round_records)
+
+        print(f'resumed {len(replayed)} pulls and {len(pending)} of an interrupted round from {journal}')
+
+        return replayed, pending
+
+    def _record_pull(self, round_idx: int, round_size: int, arm_idx: int, reward: int, n: int, log_data: list, **extra):
+        if self.journal is None:
+            return
+
+        self.journal.append({
+            'round': round_idx,
+            'round_size': round_size,
+            'arm': arm_idx,
+            'reward': reward,
+            'n': n,
+            'logs': log_data,
+            'arm_state': self.problems.arm_state(arm_idx),
+            'rng': get_rng_state(),
+            **extra
+        })
+
+    def _close_journal(self):
+        if self.journal is not None:
+            self.journal.close()
     
     def theta_extrema(self, theta: ArrayLike, k: int) -> str:
         result  = []
@@ -76,20 +166,54 @@ class ThompsonOpt(Optimizer):
         return np.random.beta(self.beta_prior[0] + success, self.beta_prior[1] + total - success)
     
     def sample_beta_all(self):
-        return np.array([self.sample_beta(self.successes[i], self.pulls[i]) for i in range(self.num_arms)])
+        # one vectorized draw, same stream as sampling each arm in turn
+        return self.sample_beta(self.successes, self.pulls)
 
-    def optimize(self, budget: int, samples_per_pull: int, maximize: bool = True, verbose: bool = False) -> tuple[list[int], dict[int, float]]:
+    def optimize(
+            self,
+            budget: int,
+            samples_per_pull: int,
+            maximize: bool = True,
+            verbose: bool = False,
+            q: int = 1,
+            journal: str = None
+        ) -> tuple[list[int], dict[int, float]]:
+        '''
+        Pull one arm at a time, or with q > 1 pull the top q distinct arms of each posterior
+        draw per round and evaluate them concurrently.
+
+        With a journal path, every pull is appended to it as it finishes, and a rerun with
+        the same journal resumes where the last run stopped, making the same decisions.
+        '''
         assert budget % samples_per_pull == 0, 'budget must be divisible by samples_per_pull'
 
         num_pulls = budget // samples_per_pull
 
-        for i in range(num_pulls):
+        config = {'optimizer': type(self).__name__, 'samples_per_pull': samples_per_pull, 'maximize': maximize, 'q': q}
+        replayed, pending = self._open_journal(journal, config)
+
+        try:
+            if q > 1:
+                return self._optimize_batch(num_pulls, samples_per_pull, maximize, verbose, q, replayed, pending)
+
+            return self._optimize_sequential(num_pulls, samples_per_pull, maximize, verbose, len(replayed))
+        finally:
+            self._close_journal()
+
+    def _optimize_sequential(self, num_pulls: int, samples_per_pull: int, maximize: bool, verbose: bool, start: int) -> tuple[list[int], dict[int, float]]:
+        for i in range(start, num_pulls):
+            sampleable = self.problems.sampleable_arms(samples_per_pull)
+            if not sampleable.any():
+                print(f'{i}/{num_pulls}: all arms exhausted, stopping early')
+                break
+
             theta = self.sample_beta_all()
 
+            # exhausted arms can never be picked
             if maximize:
-                arm_idx = np.argmax(theta)
+                arm_idx = np.argmax(np.where(sampleable, theta, -np.inf))
             else:
-                arm_idx = np.argmin(theta)
+                arm_idx = np.argmin(np.where(sampleable, theta, np.inf))
             
             if verbose:
                 print(f'{i}/{num_pulls}: theta vals\n{self.theta_extrema(theta, 5)}')
@@ -100,21 +224,465 @@ class ThompsonOpt(Optimizer):
             if verbose:
                 print(f'{i}/{num_pulls}: calling reward function')
             
-            reward, log_data = self.reward_func(samples)
-
-            self.pull_logs[arm_idx].extend(log_data)
+            reward, log_data = self._reward(samples)
 
             if verbose:
                 print(f'{i}/{num_pulls}: reward: {reward}')
 
-            self.successes[arm_idx] += reward
-            self.pulls[arm_idx] += samples_per_pull
+            self._apply_pull(arm_idx, reward, samples_per_pull, log_data)
+            self._record_pull(i, 1, arm_idx, reward, samples_per_pull, log_data)
 
             if verbose:
                 print(f'{i}: arm {arm_idx} has {self.successes[arm_idx]} successes and {self.pulls[arm_idx]} pulls\n\n')
         
         return self.ranked_arms(maximize)
 
+    def _optimize_batch(
+            self,
+            num_pulls: int,
+            samples_per_pull: int,
+            maximize: bool,
+            verbose: bool,
+            q: int,
+            replayed: list[dict],
+            pending: dict[int, dict]
+        ) -> tuple[list[int], dict[int, float]]:
+        pulls_done = len(replayed)
+        round_idx = replayed[-1]['round'] + 1 if replayed else 0
+
+        with ThreadPoolExecutor(max_workers=q) as executor:
+            while pulls_done < num_pulls:
+                sampleable = self.problems.sampleable_arms(samples_per_pull)
+                if not sampleable.any():
+                    print(f'{pulls_done}/{num_pulls}: all arms exhausted, stopping early')
+                    break
+
+                theta = self.sample_beta_all()
+
+                # best q distinct sampleable arms of this posterior draw
+                order = np.argsort(-theta if maximize else theta, kind='stable')
+                order = order[sampleable[order]]
+                arm_idxs = order[:min(q, num_pulls - pulls_done)]
+
+                if verbose:
+                    print(f'{pulls_done}/{num_pulls}: theta vals\n{self.theta_extrema(theta, 5)}')
+                    print(f'{pulls_done}/{num_pulls}: round {round_idx} pulling arms {list(arm_idxs)}')
+
+                if not set(pending) <= set(arm_idxs.tolist()):
+                    raise ValueError('journal does not match this run: interrupted round pulled other arms')
+
+                # the problem space is sampled here, only the reward calls run concurrently
+                futures = {}
+                for arm_idx in arm_idxs:
+                    samples = self.problems.sample_arm(arm_idx, samples_per_pull)
+
+                    if arm_idx in pending:
+                        # finished before the interruption, and already in the journal
+                        record = pending.pop(arm_idx)
+                        self._apply_pull(arm_idx, record['reward'], record['n'], record['logs'])
+                        continue
+
+                    futures[executor.submit(self._reward, samples)] = arm_idx
+
+                error = None
+                for future in as_completed(futures):
+                    arm_idx = futures[future]
+                    try:
+                        reward, log_data = future.result()
+                    except Exception as e:
+                        # keep journaling the pulls still in flight, so a resume does not pay for them again
+                        error = error or e
+                        continue
+
+                    self._apply_pull(arm_idx, reward, samples_per_pull, log_data)
+                    self._record_pull(round_idx, len(arm_idxs), arm_idx, reward, samples_per_pull, log_data)
+
+                    if verbose:
+                        print(f'{pulls_done}/{num_pulls}: arm {arm_idx} reward: {reward}, {self.successes[arm_idx]} successes and {self.pulls[arm_idx]} pulls')
+
+                if error is not None:
+                    raise error
+
+                pulls_done += len(arm_idxs)
+                round_idx += 1
+
+        return self.ranked_arms(maximize)
+
+
+class TwoSidedThompsonOpt(ThompsonOpt):
+    '''
+    Searches for the best and the worst arms from one shared budget. Each round draws
+    one posterior sample, takes the Thompson pick of both ends, and pulls the one whose
+    posterior is more uncertain, so observations serve both ends.
+    '''
+    def beta_variance(self, arm_idx: int) -> float:
+        a = self.beta_prior[0] + self.successes[arm_idx]
+        b = self.beta_prior[1] + self.pulls[arm_idx] - self.successes[arm_idx]
+        return a * b / ((a + b) ** 2 * (a + b + 1))
+
+    def optimize(self, budget: int, samples_per_pull: int, verbose: bool = False, journal: str = None) -> tuple[list[int], dict[int, float]]:
+        '''
+        Returns ranked_arms(maximize=True): read the best arms from the front and the worst from the back.
+        '''
+        assert budget % samples_per_pull == 0, 'budget must be divisible by samples_per_pull'
+
+        num_pulls = budget // samples_per_pull
+
+        config = {'optimizer': type(self).__name__, 'samples_per_pull': samples_per_pull}
+        replayed, _ = self._open_journal(journal, config)
+
+        try:
+            return self._optimize_two_sided(num_pulls, samples_per_pull, verbose, replayed)
+        finally:
+            self._close_journal()
+
+    def _optimize_two_sided(self, num_pulls: int, samples_per_pull: int, verbose: bool, replayed: list[dict]) -> tuple[list[int], dict[int, float]]:
+        # pulls spent on each end, to break ties between equally uncertain picks
+        end_pulls = {'max': 0, 'min': 0}
+        for record in replayed:
+            end_pulls[record['end']] += 1
+
+        for i in range(len(replayed), num_pulls):
+            sampleable = self.problems.sampleable_arms(samples_per_pull)
+            if not sampleable.any():
+                print(f'{i}/{num_pulls}: all arms exhausted, stopping early')
+                break
+
+            theta = self.sample_beta_all()
+
+            picks = {
+                'max': np.argmax(np.where(sampleable, theta, -np.inf)),
+                'min': np.argmin(np.where(sampleable, theta, np.inf))
+            }
+
+            end = max(picks, key=lambda e: (self.beta_variance(picks[e]), -end_pulls[e]))
+            arm_idx = picks[end]
+            end_pulls[end] += 1
+
+            if verbose:
+                print(f'{i}/{num_pulls}: theta vals\n{self.theta_extrema(theta, 5)}')
+                print(f'{i}/{num_pulls}: pulling {end} arm {arm_idx} with theta {theta[arm_idx]}')
+
+            samples = self.problems.sample_arm(arm_idx, samples_per_pull)
+
+            reward, log_data = self._reward(samples)
+
+            if verbose:
+                print(f'{i}/{num_pulls}: reward: {reward}')
+
+            self._apply_pull(arm_idx, reward, samples_per_pull, log_data)
+            self._record_pull(i, 1, arm_idx, reward, samples_per_pull, log_data, end=end)
+
+            if verbose:
+                print(f'{i}: arm {arm_idx} has {self.successes[arm_idx]} successes and {self.pulls[arm_idx]} pulls\n\n')
+
+        return self.ranked_arms(True)
+
+
+class FeatureThompsonOpt(Optimizer):
+    '''
+    Thompson sampling over a Bayesian logistic regression on the structural features of
+    each arm's tree (see mwp.trees.features), so a pull informs every arm with similar
+    structure. The posterior over weights is a Laplace approximation at the MAP.
+    '''
+    def __init__(
+            self,
+            problems: ProblemSpace,
+            reward_func: Callable[[pd.DataFrame], tuple[int, list]],
+            prior_var: float = 1.0,
+            newton_steps: int = 50
+        ):
+        self.problems = problems
+        self.reward_func = reward_func
+        self.prior_var = prior_var
+        self.newton_steps = newton_steps
+
+        self.num_arms = self.problems.num_arms()
+
+        self.successes = np.zeros(self.num_arms)
+        self.pulls = np.zeros(self.num_arms)
+
+        self.pull_logs = [[] for _ in range(self.num_arms)]
+
+        X, names = feature_matrix([self.problems.arm_tree(i) for i in range(self.num_arms)])
+
+        # standardized so a single prior scale suits every feature
+        std = X.std(axis=0)
+        std[std == 0] = 1
+        self.X = np.hstack([np.ones((self.num_arms, 1)), (X - X.mean(axis=0)) / std])
+        self.feature_names = ['intercept'] + names
+
+        self.w = np.zeros(self.X.shape[1])
+        self.cov = self.prior_var * np.eye(self.X.shape[1])
+
+    def fit(self):
+        '''
+        Newton's method for the MAP weights given the binomial counts of the pulled arms.
+        Always starts from zero, so the fit depends only on the counts and a run resumed
+        from a journal matches an uninterrupted one.
+        '''
+        pulled = self.pulls > 0
+        X, s, n = self.X[pulled], self.successes[pulled], self.pulls[pulled]
+
+        prior_prec = np.eye(X.shape[1]) / self.prior_var
+
+        def _log_posterior(w):
+            z = X @ w
+            # s * log(p) + (n - s) * log(1 - p), written stably
+            return np.sum(s * z - n * np.logaddexp(0, z)) - 0.5 * w @ prior_prec @ w
+
+        def _hessian(w):
+            p = _sigmoid(X @ w)
+            return p, X.T @ (X * (n * p * (1 - p))[:, None]) + prior_prec
+
+        w = np.zeros(X.shape[1])
+        for _ in range(self.newton_steps):
+            p, H = _hessian(w)
+            step = np.linalg.solve(H, X.T @ (s - n * p) - prior_prec @ w)
+
+            # halve the step until the posterior improves, plain Newton can overshoot
+            current = _log_posterior(w)
+            while _log_posterior(w + step) < current and np.max(np.abs(step)) > 1e-10:
+                step /= 2
+            w = w + step
+
+            if np.max(np.abs(step)) < 1e-6:
+                break
+
+        self.w = w
+        self.cov = np.linalg.inv(_hessian(w)[1])
+
+    def sample_theta(self) -> np.ndarray:
+        return _sigmoid(self.X @ np.random.multivariate_normal(self.w, self.cov))
+
+    def ranked_arms(self, maximize: bool = True) -> tuple[list[int], dict[int, float]]:
+        # every arm gets an estimate from its features, pulled or not
+        theta = _sigmoid(self.X @ self.w)
+        theta_estimates = dict(enumerate(theta.tolist()))
+
+        return sorted(theta_estimates, key=lambda x: theta_estimates[x], reverse=maximize), theta_estimates
+
+    def coefficients(self) -> dict[str, float]:
+        return dict(zip(self.feature_names, self.w.tolist()))
+
+    def optimize(
+            self,
+            budget: int,
+            samples_per_pull: int,
+            maximize: bool = True,
+            verbose: bool = False,
+            journal: str = None
+        ) -> tuple[list[int], dict[int, float]]:
+        assert budget % samples_per_pull == 0, 'budget must be divisible by samples_per_pull'
+
+        num_pulls = budget // samples_per_pull
+
+        config = {'optimizer': type(self).__name__, 'samples_per_pull': samples_per_pull, 'maximize': maximize}
+        replayed, _ = self._open_journal(journal, config)
+
+        try:
+            if replayed:
+                self.fit()
+
+            return self._optimize_features(num_pulls, samples_per_pull, maximize, verbose, len(replayed))
+        finally:
+            self._close_journal()
+
+    def _optimize_features(self, num_pulls: int, samples_per_pull: int, maximize: bool, verbose: bool, start: int) -> tuple[list[int], dict[int, float]]:
+        for i in range(start, num_pulls):
+            sampleable = self.problems.sampleable_arms(samples_per_pull)
+            if not sampleable.any():
+                print(f'{i}/{num_pulls}: all arms exhausted, stopping early')
+                break
+
+            theta = self.sample_theta()
+
+            # arms with the same features tie, so pick among them at random
+            masked = np.where(sampleable, theta if maximize else -theta, -np.inf)
+            arm_idx = np.random.choice(np.flatnonzero(masked == masked.max()))
+
+            if verbose:
+                print(f'{i}/{num_pulls}: theta vals\n{self.theta_extrema(theta, 5)}')
+                print(f'{i}/{num_pulls}: pulling arm {arm_idx} with theta {theta[arm_idx]}')
+
+            samples = self.problems.sample_arm(arm_idx, samples_per_pull)
+
+            reward, log_data = self._reward(samples)
+
+            if verbose:
+                print(f'{i}/{num_pulls}: reward: {reward}')
+
+            self._apply_pull(arm_idx, reward, samples_per_pull, log_data)
+            self._record_pull(i, 1, arm_idx, reward, samples_per_pull, log_data)
+
+            self.fit()
+
+            if verbose:
+                print(f'{i}: arm {arm_idx} has {self.successes[arm_idx]} successes and {self.pulls[arm_idx]} pulls\n\n')
+
+        return self.ranked_arms(maximize)
+
+
+class LUCBOpt(Optimizer):
+    '''
+    LUCB1 (Kalyanakrishnan et al., 2012) for identifying the k best (or, with maximize=False,
+    worst) arms. Each round pulls the weakest arm inside the current top k and the strongest
+    outside it, and the search stops once their Hoeffding bounds separate at confidence
+    1 - delta (up to epsilon), instead of spending the whole budget.
+    '''
+    def __init__(
+            self,
+            problems: ProblemSpace,
+            reward_func: Callable[[pd.DataFrame], tuple[int, list]],
+            k: int = 1,
+            delta: float = 0.1,
+            epsilon: float = 0.0
+        ):
+        self.problems = problems
+        self.reward_func = reward_func
+        self.k = k
+        self.delta = delta
+        self.epsilon = epsilon
+
+        self.num_arms = self.problems.num_arms()
+
+        self.successes = np.zeros(self.num_arms)
+        self.pulls = np.zeros(self.num_arms)
+
+        self.pull_logs = [[] for _ in range(self.num_arms)]
+
+        self.stopped_early = False
+        self.budget_saved = 0
+        self.bounds = {}
+
+    def confidence_bounds(self, round_idx: int, maximize: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        '''
+        Means and lower/upper confidence bounds of every arm, on the success rate when
+        maximizing and on the failure rate otherwise. Unpulled arms span [0, 1].
+        '''
+        pulled = self.pulls > 0
+        means = np.divide(self.successes, self.pulls, out=np.full(self.num_arms, 0.5), where=pulled)
+        if not maximize:
+            means = 1 - means
+
+        t = round_idx + 1
+        radius = np.full(self.num_arms, np.inf)
+        radius[pulled] = np.sqrt(np.log(5 * self.num_arms * t ** 4 / (4 * self.delta)) / (2 * self.pulls[pulled]))
+
+        return means, np.clip(means - radius, 0, 1), np.clip(means + radius, 0, 1)
+
+    def _critical_arms(self, means, lower, upper) -> tuple[int, int]:
+        order = np.argsort(-means, kind='stable')
+        top, rest = order[:self.k], order[self.k:]
+
+        weakest = top[np.argmin(lower[top])]
+        strongest = rest[np.argmax(upper[rest])]
+
+        return weakest, strongest
+
+    def optimize(
+            self,
+            budget: int,
+            samples_per_pull: int,
+            maximize: bool = True,
+            verbose: bool = False,
+            journal: str = None
+        ) -> tuple[list[int], dict[int, float]]:
+        '''
+        Sets stopped_early, budget_saved (unspent samples) and bounds (arm -> (lower, upper)
+        on the success rate, for the top k and the strongest challenger).
+        '''
+        assert budget % samples_per_pull == 0, 'budget must be divisible by samples_per_pull'
+        assert self.k < self.num_arms, 'k must be smaller than the number of arms'
+
+        num_pulls = budget // samples_per_pull
+
+        config = {
+            'optimizer': type(self).__name__,
+            'samples_per_pull': samples_per_pull,
+            'maximize': maximize,
+            'k': self.k,
+            'delta': self.delta,
+            'epsilon': self.epsilon
+        }
+        replayed, pending = self._open_journal(journal, config)
+
+        try:
+            return self._optimize_lucb(num_pulls, samples_per_pull, maximize, verbose, replayed, pending)
+        finally:
+            self._close_journal()
+
+    def _optimize_lucb(
+            self,
+            num_pulls: int,
+            samples_per_pull: int,
+            maximize: bool,
+            verbose: bool,
+            replayed: list[dict],
+            pending: dict[int, dict]
+        ) -> tuple[list[int], dict[int, float]]:
+        pulls_done = len(replayed)
+        round_idx = replayed[-1]['round'] + 1 if replayed else 0
+
+        self.stopped_early = False
+
+        while pulls_done < num_pulls:
+            means, lower, upper = self.confidence_bounds(round_idx, maximize)
+            weakest, strongest = self._critical_arms(means, lower, upper)
+
+            gap = upper[strongest] - lower[weakest]
+            if gap < self.epsilon or (self.epsilon == 0 and gap <= 0):
+                self.stopped_early = True
+                break
+
+            sampleable = self.problems.sampleable_arms(samples_per_pull)
+            arm_idxs = [arm_idx for arm_idx in dict.fromkeys([weakest, strongest]) if sampleable[arm_idx]]
+            arm_idxs = arm_idxs[:num_pulls - pulls_done]
+
+            if not arm_idxs:
+                print(f'{pulls_done}/{num_pulls}: critical arms exhausted, stopping early')
+                break
+
+            if verbose:
+                print(f'{pulls_done}/{num_pulls}: round {round_idx} pulling arms {arm_idxs}, gap {gap}')
+
+            for arm_idx in arm_idxs:
+                samples = self.problems.sample_arm(arm_idx, samples_per_pull)
+
+                if arm_idx in pending:
+                    record = pending.pop(arm_idx)
+                    self._apply_pull(arm_idx, record['reward'], record['n'], record['logs'])
+                    continue
+
+                reward, log_data = self._reward(samples)
+
+                self._apply_pull(arm_idx, reward, samples_per_pull, log_data)
+                self._record_pull(round_idx, len(arm_idxs), arm_idx, reward, samples_per_pull, log_data)
+
+                if verbose:
+                    print(f'{pulls_done}/{num_pulls}: arm {arm_idx} has {self.successes[arm_idx]} successes and {self.pulls[arm_idx]} pulls')
+
+            pulls_done += len(arm_idxs)
+            round_idx += 1
+
+        self.budget_saved = (num_pulls - pulls_done) * samples_per_pull
+
+        means, lower, upper = self.confidence_bounds(round_idx, maximize)
+        weakest, strongest = self._critical_arms(means, lower, upper)
+
+        order = np.argsort(-means, kind='stable')
+        reported = list(order[:self.k]) + [strongest]
+        if maximize:
+            self.bounds = {int(i): (float(lower[i]), float(upper[i])) for i in reported}
+        else:
+            # back from failure rates to success rates
+            self.bounds = {int(i): (float(1 - upper[i]), float(1 - lower[i])) for i in reported}
+
+        if verbose:
+            print(f'stopped early: {self.stopped_early}, budget saved: {self.budget_saved}, bounds: {self.bounds}')
+
+        return self.ranked_arms(maximize)
+
 
 class UniformOpt(Optimizer):
     def __init__(
@@ -132,13 +700,27 @@ class UniformOpt(Optimizer):
 
         self.pull_logs = [[] for _ in range(self.num_arms)]
     
-    def optimize(self, budget: int, samples_per_pull: int, maximize: bool = True, verbose: bool = False):
+    def optimize(self, budget: int, samples_per_pull: int, maximize: bool = True, verbose: bool = False, journal: str = None):
         assert budget % samples_per_pull == 0, 'budget must be divisible by samples_per_pull'
 
         num_pulls = budget // samples_per_pull
 
-        for i in range(num_pulls):
-            arm_idx = np.random.randint(self.num_arms)
+        config = {'optimizer': type(self).__name__, 'samples_per_pull': samples_per_pull}
+        replayed, _ = self._open_journal(journal, config)
+
+        try:
+            return self._optimize_uniform(num_pulls, samples_per_pull, maximize, verbose, len(replayed))
+        finally:
+            self._close_journal()
+
+    def _optimize_uniform(self, num_pulls: int, samples_per_pull: int, maximize: bool, verbose: bool, start: int):
+        for i in range(start, num_pulls):
+            sampleable = np.flatnonzero(self.problems.sampleable_arms(samples_per_pull))
+            if len(sampleable) == 0:
+                print(f'{i}/{num_pulls}: all arms exhausted, stopping early')
+                break
+
+            arm_idx = np.random.choice(sampleable)
             
             if verbose:
                 print(f'{i}/{num_pulls}: pulling arm {arm_idx}')
@@ -148,15 +730,13 @@ class UniformOpt(Optimizer):
             if verbose:
                 print(f'{i}/{num_pulls}: calling reward function')
             
-            reward, log_data = self.reward_func(samples)
-
-            self.pull_logs[arm_idx].extend(log_data)
+            reward, log_data = self._reward(samples)
 
             if verbose:
                 print(f'{i}/{num_pulls}: reward: {reward}')
 
-            self.successes[arm_idx] += reward
-            self.pulls[arm_idx] += samples_per_pull
+            self._apply_pull(arm_idx, reward, samples_per_pull, log_data)
+            self._record_pull(i, 1, arm_idx, reward, samples_per_pull, log_data)
 
             if verbose:
                 print(f'{i}/{num_pulls}: arm {arm_idx} has {self.successes[arm_idx]} successes and {self.pulls[arm_idx]} pulls\n\n')
@@ -1,2 +1,3 @@
-from .trees import ValuesSampler, grammar_to_trees
+from .trees import ValuesSampler, grammar_to_trees, iter_trees
+from .counting import TreeCounter
 from .viz import make_graphviz
@@ -0,0 +1,101 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+
+# bump when the contents of populate/backtrack tables change meaning
+CACHE_VERSION = 1
+
+CSR_FIELDS = ('targets', 'offsets', 'lefts', 'rights')
+
+
+def _digest(obj) -> str:
+    return hashlib.sha1(repr(obj).encode('utf-8')).hexdigest()
+
+
+class TableCache():
+    '''
+    Content-addressed on-disk store of populate/backtrack tables.
+
+    Each subtree gets a directory keyed by (hash_tree(subtree), val_range, key) holding
+    its backtrack table as CSR arrays, which are loaded memory-mapped on demand. Changing
+    CACHE_VERSION or key invalidates every existing entry. Each store's meta.json records
+    its version, val_range and key, and is checked when the store is opened.
+    '''
+    def __init__(self, cache_dir: str, val_range: tuple[int, int], key: str = ''):
+        self.cache_dir = cache_dir
+        self.val_range = tuple(val_range)
+        self.key = key
+
+        self.root = os.path.join(
+            cache_dir,
+            f'v{CACHE_VERSION}',
+            _digest((self.val_range, key))
+        )
+
+        self._open_meta()
+
+    def _meta(self) -> dict:
+        return {'version': CACHE_VERSION, 'val_range': list(self.val_range), 'key': self.key}
+
+    def _open_meta(self):
+        os.makedirs(self.root, exist_ok=True)
+
+        meta_path = os.path.join(self.root, 'meta.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+            if meta != self._meta():
+                raise ValueError(f'{self.root} holds tables for {meta}, expected {self._meta()}')
+            return
+
+        # written whole and renamed into place, so concurrent openers never read a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.root)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._meta(), f)
+        os.replace(tmp_path, meta_path)
+
+    def _path(self, tree_hash: tuple) -> str:
+        digest = _digest(tree_hash)
+        return os.path.join(self.root, digest[:2], digest)
+
+    def __contains__(self, tree_hash: tuple) -> bool:
+        return os.path.exists(self._path(tree_hash))
+
+    def load(self, tree_hash: tuple) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        path = self._path(tree_hash)
+        return tuple(
+            np.load(os.path.join(path, f'{field}.npy'), mmap_mode='r')
+            for field in CSR_FIELDS
+        )
+
+    def load_values(self, tree_hash: tuple) -> set:
+        targets = np.load(os.path.join(self._path(tree_hash), 'targets.npy'), mmap_mode='r')
+        return set(targets.tolist())
+
+    def save(self, tree_hash: tuple, csr: tuple):
+        path = self._path(tree_hash)
+        if os.path.exists(path):
+            return
+
+        parent = os.path.dirname(path)
+        os.makedirs(parent, exist_ok=True)
+
+        # write to a temporary directory, then rename so readers never see partial entries
+        tmp_path = tempfile.mkdtemp(dir=parent)
+        for field, arr in zip(CSR_FIELDS, csr):
+            np.save(os.path.join(tmp_path, f'{field}.npy'), arr)
+
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # another process wrote the same entry first
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+    def clear(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+        self._open_meta()
@@ -0,0 +1,36 @@
+from nltk.tree import Tree
+
+
+COMMUTATIVE_OPS = ('+', '*')
+
+
+def _sort_key(tree) -> tuple:
+    return tuple(tree.leaves()) if isinstance(tree, Tree) else (tree,)
+
+def in_canonical_order(children: list, commutative_ops=COMMUTATIVE_OPS) -> bool:
+    '''
+    Check that the arguments of a commutative binary node are in sorted order.
+    Assumes the arguments themselves are already canonical.
+    '''
+    if len(children) != 3 or children[1] not in commutative_ops:
+        return True
+
+    return _sort_key(children[0]) <= _sort_key(children[2])
+
+def canonicalize(tree: Tree, commutative_ops=COMMUTATIVE_OPS) -> Tree:
+    '''
+    Get the representative of tree under reordering the arguments of commutative operators,
+    e.g. (B + A) and (A + B) map to the same tree.
+    '''
+    if not isinstance(tree, Tree):
+        return tree
+
+    children = [canonicalize(child, commutative_ops) for child in tree]
+
+    if not in_canonical_order(children, commutative_ops):
+        children = [children[2], children[1], children[0]]
+
+    return Tree(tree.label(), children)
+
+def canonical_expr(tree: Tree, commutative_ops=COMMUTATIVE_OPS) -> list[str]:
+    return canonicalize(tree, commutative_ops).leaves()
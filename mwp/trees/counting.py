@@ -0,0 +1,163 @@
+import sys
+import math
+import random
+from nltk import CFG
+from nltk.grammar import Nonterminal
+from nltk.tree import Tree
+
+
+class TreeCounter():
+    '''
+    Counts and unranks the trees yielded by iter_trees without enumerating them.
+
+    count_symbol(item, depth) is the number of derivations of item within a depth budget
+    (using nltk generate's depth rules). A derivation fits budget b iff its height is at
+    most b - 1, which is what lets min_depth be handled as a difference of counts.
+    '''
+    def __init__(self, grammar):
+        if isinstance(grammar, str):
+            grammar = CFG.fromstring(grammar)
+
+        self.grammar = grammar
+
+        self._symbol_counts = {}
+        self._seq_counts = {}
+
+    def count_symbol(self, item, depth: int) -> int:
+        if depth <= 0:
+            return 0
+
+        if not isinstance(item, Nonterminal):
+            return 1
+
+        key = (item, depth)
+        if key not in self._symbol_counts:
+            self._symbol_counts[key] = sum(
+                self._seq_total(prod.rhs(), depth - 1)
+                for prod in self.grammar.productions(lhs=item)
+            )
+
+        return self._symbol_counts[key]
+
+    def _seq_total(self, items: tuple, depth: int) -> int:
+        key = (items, depth)
+        if key not in self._seq_counts:
+            self._seq_counts[key] = math.prod(self.count_symbol(item, depth) for item in items)
+
+        return self._seq_counts[key]
+
+    def _seq_below(self, items: tuple, depth: int, thresh: int) -> int:
+        # number of sequences whose tallest item is shorter than thresh
+        if thresh <= 0:
+            return 0
+
+        return self._seq_total(items, min(depth, thresh))
+
+    def count(self, max_depth: int, min_depth: int = 0) -> int:
+        '''
+        Number of trees iter_trees(grammar, max_depth, min_depth) would yield.
+        '''
+        start = self.grammar.start()
+        return self.count_symbol(start, max_depth) - self.count_symbol(start, min(max_depth, min_depth))
+
+    def counts_by_depth(self, max_depth: int) -> dict[int, int]:
+        '''
+        Number of trees of each height that fit in max_depth.
+        '''
+        start = self.grammar.start()
+
+        counts = {}
+        for height in range(max_depth):
+            num = self.count_symbol(start, height + 1) - self.count_symbol(start, height)
+            if num > 0:
+                counts[height] = num
+
+        return counts
+
+    def _unrank_one(self, item, depth, thresh, w_hi, w_lo, k):
+        # derivations of height >= thresh have weight w_hi, the rest w_lo; k indexes into
+        # the weighted enumeration and the leftover offset is returned for the caller
+        if not isinstance(item, Nonterminal):
+            return [item], item, 0, k
+
+        for prod in self.grammar.productions(lhs=item):
+            rhs = prod.rhs()
+
+            total = self._seq_total(rhs, depth - 1)
+            below = self._seq_below(rhs, depth - 1, thresh - 1)
+            block = w_hi * (total - below) + w_lo * below
+
+            if k < block:
+                tokens, children, height, k = self._unrank_seq(rhs, depth - 1, thresh - 1, w_hi, w_lo, k)
+                return tokens, Tree(item.symbol(), children), 1 + height, k
+
+            k -= block
+
+        raise IndexError('tree rank out of range')
+
+    def _unrank_seq(self, items, depth, thresh, w_hi, w_lo, k):
+        if not items:
+            return [], [], 0, k
+
+        rest = items[1:]
+        rest_total = self._seq_total(rest, depth)
+        rest_below = self._seq_below(rest, depth, thresh)
+
+        # weight of each derivation of the first item, summed over every completion of the rest
+        first_hi = w_hi * rest_total
+        first_lo = w_hi * (rest_total - rest_below) + w_lo * rest_below
+
+        first_tokens, first_node, first_height, k = self._unrank_one(items[0], depth, thresh, first_hi, first_lo, k)
+
+        if first_height >= thresh:
+            rest_weights = (w_hi, w_hi)
+        else:
+            rest_weights = (w_hi, w_lo)
+
+        rest_tokens, rest_nodes, rest_height, k = self._unrank_seq(rest, depth, thresh, *rest_weights, k)
+
+        return first_tokens + rest_tokens, [first_node] + rest_nodes, max(first_height, rest_height), k
+
+    def unrank(self, k: int, max_depth: int, min_depth: int = 0) -> tuple[list, list[Tree]]:
+        '''
+        Get the k-th (expr, [tree]) of iter_trees(grammar, max_depth, min_depth) directly.
+        '''
+        if not 0 <= k < self.count(max_depth, min_depth=min_depth):
+            raise IndexError('tree rank out of range')
+
+        expr, tree, _, _ = self._unrank_one(self.grammar.start(), max_depth, min_depth, 1, 0, k)
+
+        return expr, [tree]
+
+    def sample_ranks(self, n: int, max_depth: int, min_depth: int = 0) -> list[int]:
+        '''
+        Uniformly sample n distinct tree ranks.
+        '''
+        total = self.count(max_depth, min_depth=min_depth)
+
+        if total <= sys.maxsize:
+            ranks = random.sample(range(total), n)
+        else:
+            # too large for random.sample, but collisions are vanishingly rare
+            ranks = []
+            seen = set()
+            while len(ranks) < n:
+                k = random.randrange(total)
+                if k not in seen:
+                    seen.add(k)
+                    ranks.append(k)
+
+        return ranks
+
+    def sample(self, n: int, max_depth: int, min_depth: int = 0) -> tuple[tuple, tuple]:
+        '''
+        Uniformly sample n distinct trees, in time proportional to n rather than the number of trees.
+        '''
+        ranks = self.sample_ranks(n, max_depth, min_depth=min_depth)
+
+        if n == 0:
+            return (), ()
+
+        exprs, trees = zip(*[self.unrank(k, max_depth, min_depth=min_depth) for k in ranks])
+
+        return exprs, trees
@@ -0,0 +1,55 @@
+import numpy as np
+from nltk.tree import Tree
+
+from .samples import tree_template
+
+
+def tree_features(tree: Tree) -> dict[str, int]:
+    '''
+    Structural features of a parse tree: the number of each operator ('op:+'), the
+    operator depth and number of leaves, and parent-child operator pairs ('op:+>*'),
+    which count patterns like consecutive additions.
+    '''
+    shape, _ = tree_template(tree)
+
+    features = {}
+
+    def _add(name):
+        features[name] = features.get(name, 0) + 1
+
+    def _walk(node, parent_op):
+        if not isinstance(node[1], list):
+            _add('leaves')
+            return 0
+
+        op = node[0]
+        _add(f'op:{op}')
+        if parent_op is not None:
+            _add(f'op:{parent_op}>{op}')
+
+        return 1 + max(_walk(child, op) for child in node[1])
+
+    features['depth'] = _walk(shape, None)
+
+    return features
+
+
+def feature_matrix(trees: list[Tree], names: list[str] = None) -> tuple[np.ndarray, list[str]]:
+    '''
+    Stack tree_features into an (n_trees, n_features) array. Without names, the columns are
+    every feature seen, sorted.
+    '''
+    features = [tree_features(tree) for tree in trees]
+
+    if names is None:
+        names = sorted(set(name for f in features for name in f))
+
+    col_idx = {name: i for i, name in enumerate(names)}
+
+    X = np.zeros((len(trees), len(names)))
+    for i, f in enumerate(features):
+        for name, val in f.items():
+            if name in col_idx:
+                X[i, col_idx[name]] = val
+
+    return X, names
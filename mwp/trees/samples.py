@@ -0,0 +1,92 @@
+import numpy as np
+from nltk.tree import Tree
+
+
+def tree_template(tree: Tree) -> tuple[list, str]:
+    '''
+    Get the tree_vals shape of a parse tree, with leaves as ['NUM', leaf_idx], and a
+    format string for tree_str with one positional slot per leaf.
+    '''
+    counter = [0]
+
+    def _template(node):
+        if node.label() == 'S':
+            return _template(node[0])
+
+        if node.label() == 'N':
+            idx = counter[0]
+            counter[0] += 1
+            return ['NUM', idx], '{}'
+
+        if node.label() == 'E':
+            return _template(node[1])
+
+        assert len(node) == 3 # two args and one operator
+        left_shape, left_fmt = _template(node[0])
+        right_shape, right_fmt = _template(node[2])
+
+        return [node[1], [left_shape, right_shape]], f'({left_fmt} {node[1]} {right_fmt})'
+
+    return _template(tree)
+
+
+def fill_template(shape: list, leaf_vals: list) -> list:
+    '''
+    Substitute leaf values into a tree_template shape.
+    '''
+    if not isinstance(shape[1], list):
+        return ['NUM', leaf_vals[shape[1]]]
+
+    return [shape[0], [fill_template(child, leaf_vals) for child in shape[1]]]
+
+
+def tree_leaves(tree_vals: list) -> list:
+    '''
+    Leaf values of a tree_vals list, left to right.
+    '''
+    if not isinstance(tree_vals[1], list):
+        return [tree_vals[1]]
+
+    return [val for child in tree_vals[1] for val in tree_leaves(child)]
+
+
+class SampleBatch():
+    '''
+    n_samples value assignments for a single tree, stored as one array per leaf.
+    tree_vals and tree_str are only built when asked for.
+    '''
+    def __init__(self, shape: list, fmt: str, leaf_vals: list[np.ndarray], target_vals: np.ndarray):
+        self.shape = shape
+        self.fmt = fmt
+        self.leaf_vals = leaf_vals
+        self.target_vals = target_vals
+
+    def __len__(self) -> int:
+        return len(self.target_vals)
+
+    def leaf_matrix(self) -> np.ndarray:
+        '''
+        Leaf values as an (n_samples, n_leaves) array.
+        '''
+        return np.stack(self.leaf_vals, axis=1)
+
+    def _row(self, i: int) -> list[int]:
+        return [int(vals[i]) for vals in self.leaf_vals]
+
+    def tree_vals(self, i: int) -> list:
+        return fill_template(self.shape, self._row(i))
+
+    def tree_str(self, i: int) -> str:
+        return self.fmt.format(*self._row(i))
+
+    def as_tuples(self) -> tuple[tuple, tuple, tuple]:
+        '''
+        Materialize in the (tree_vals, tree_strs, target_vals) format of pick_values_dset.
+        '''
+        rows = self.leaf_matrix().tolist()
+
+        return (
+            tuple(fill_template(self.shape, row) for row in rows),
+            tuple(self.fmt.format(*row) for row in rows),
+            tuple(self.target_vals.tolist())
+        )
@@ -0,0 +1,110 @@
+import numpy as np
+
+
+def calcs_to_csr(calcs: np.ndarray, lefts: np.ndarray, rights: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Pack (calc, l, r) triples sorted by calc into (targets, offsets, lefts, rights),
+    where the pairs for targets[i] are lefts/rights[offsets[i]:offsets[i + 1]].
+    '''
+    targets, starts = np.unique(calcs, return_index=True)
+    offsets = np.append(starts, len(calcs)).astype(np.int64)
+
+    return (
+        targets.astype(np.int32),
+        offsets,
+        np.asarray(lefts, dtype=np.int32),
+        np.asarray(rights, dtype=np.int32)
+    )
+
+
+def backtrack_to_csr(tree_calcs: dict) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Pack a {calc: [(l, r), ...]} backtrack table into CSR arrays.
+    '''
+    targets = sorted(tree_calcs)
+
+    counts = [len(tree_calcs[t]) for t in targets]
+    pairs = [pair for t in targets for pair in tree_calcs[t]]
+
+    offsets = np.zeros(len(targets) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    pairs = np.array(pairs, dtype=np.int32).reshape(-1, 2)
+
+    return (
+        np.array(targets, dtype=np.int32),
+        offsets,
+        np.ascontiguousarray(pairs[:, 0]),
+        np.ascontiguousarray(pairs[:, 1])
+    )
+
+
+def csr_to_backtrack(targets: np.ndarray, offsets: np.ndarray, lefts: np.ndarray, rights: np.ndarray) -> dict:
+    '''
+    Unpack CSR arrays into a {calc: [(l, r), ...]} backtrack table.
+    '''
+    lefts = np.asarray(lefts).tolist()
+    rights = np.asarray(rights).tolist()
+    offsets = np.asarray(offsets).tolist()
+
+    return {
+        target: list(zip(lefts[offsets[i]:offsets[i + 1]], rights[offsets[i]:offsets[i + 1]]))
+        for i, target in enumerate(np.asarray(targets).tolist())
+    }
+
+
+class BacktrackTable():
+    '''
+    CSR-style backtrack table for one subtree: the (l, r) pairs that produce targets[i]
+    are (lefts[j], rights[j]) for offsets[i] <= j < offsets[i + 1].
+    '''
+    def __init__(self, targets: np.ndarray, offsets: np.ndarray, lefts: np.ndarray, rights: np.ndarray):
+        self.targets = targets
+        self.offsets = offsets
+        self.lefts = lefts
+        self.rights = rights
+
+    @classmethod
+    def from_backtrack(cls, tree_calcs: dict) -> 'BacktrackTable':
+        return cls(*backtrack_to_csr(tree_calcs))
+
+    def _index(self, target) -> int:
+        i = int(np.searchsorted(self.targets, target))
+        if i == len(self.targets) or self.targets[i] != target:
+            raise KeyError(target)
+        return i
+
+    def __contains__(self, target) -> bool:
+        try:
+            self._index(target)
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self) -> int:
+        return len(self.targets)
+
+    def __getitem__(self, target) -> list[tuple[int, int]]:
+        i = self._index(target)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return list(zip(self.lefts[start:end].tolist(), self.rights[start:end].tolist()))
+
+    def keys(self) -> list[int]:
+        return self.targets.tolist()
+
+    def choice(self, target, rng) -> tuple[int, int]:
+        '''
+        Pick a uniformly random (l, r) pair for target, using rng (e.g. the random module).
+        '''
+        i = self._index(target)
+        start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+        assert end > start
+
+        j = start + rng.randrange(end - start)
+        return int(self.lefts[j]), int(self.rights[j])
+
+    def num_pairs(self) -> int:
+        return len(self.lefts)
+
+    def nbytes(self) -> int:
+        return sum(arr.nbytes for arr in (self.targets, self.offsets, self.lefts, self.rights))
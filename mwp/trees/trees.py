@@ -1,11 +1,19 @@
-import nltk
 from nltk import CFG
-from nltk.parse.generate import generate
+from nltk.grammar import Nonterminal
 from nltk.tree import Tree
 import random
+import sys
+import time
+import numpy as np
 from tqdm.auto import tqdm
 
-from .utils import add_mem, MemDict, hash_tree
+from .utils import add_mem, MemDict, LazyMemDict, hash_tree
+from .vectorized import outer_calcs
+from .tables import BacktrackTable, calcs_to_csr, backtrack_to_csr, csr_to_backtrack
+from .cache import TableCache
+from .samples import SampleBatch, tree_template
+from .canonical import COMMUTATIVE_OPS, in_canonical_order
+from ..metrics import metrics
 
 
 op_map = {
@@ -22,31 +30,102 @@ def get_max_depth(tree):
     else:
         return 0
 
-def grammar_to_trees(grammar, max_depth, min_depth=0) -> tuple:
-    grammar = CFG.fromstring(grammar)
-    parser = nltk.ChartParser(grammar)
+def _expand_one(grammar, item, depth, commutative_ops):
+    # mirrors nltk.parse.generate: every symbol, terminal or not, needs depth > 0
+    if depth <= 0:
+        return
 
-    results = []
-
-    for expr in generate(grammar, depth=max_depth):
-        tree = parser.parse(expr)
-        results.append((expr, list(tree)))
-
-        tree_depth = get_max_depth(tree)
+    if isinstance(item, Nonterminal):
+        for prod in grammar.productions(lhs=item):
+            for tokens, children, height in _expand_all(grammar, prod.rhs(), depth - 1, commutative_ops):
+                if commutative_ops and not in_canonical_order(children, commutative_ops):
+                    continue
 
+                yield tokens, Tree(item.symbol(), children), 1 + height
+    else:
+        yield [item], item, 0
+
+def _expand_all(grammar, items, depth, commutative_ops):
+    if not items:
+        yield [], [], 0
+        return
+
+    for first_tokens, first_node, first_height in _expand_one(grammar, items[0], depth, commutative_ops):
+        for rest_tokens, rest_nodes, rest_height in _expand_all(grammar, items[1:], depth, commutative_ops):
+            yield first_tokens + rest_tokens, [first_node] + rest_nodes, max(first_height, rest_height)
+
+def iter_trees(grammar, max_depth, min_depth=0, canonical=False, commutative_ops=COMMUTATIVE_OPS):
+    '''
+    Lazily yield (expr, [tree]) for every derivation of the grammar, in the same order as
+    nltk's generate(grammar, depth=max_depth), skipping trees shallower than min_depth.
+    With canonical=True, only the canonical form of trees that are equal up to
+    commutative_ops argument order is generated.
+    '''
+    if isinstance(grammar, str):
+        grammar = CFG.fromstring(grammar)
+
+    ops = commutative_ops if canonical else ()
+
+    for expr, tree, tree_depth in _expand_one(grammar, grammar.start(), max_depth, ops):
         if tree_depth < min_depth:
             continue
 
+        yield expr, [tree]
+
+def grammar_to_trees(grammar, max_depth, min_depth=0, canonical=False) -> tuple:
+    results = list(iter_trees(grammar, max_depth, min_depth=min_depth, canonical=canonical))
+
+    if len(results) == 0:
+        return (), ()
+
     exprs, trees = zip(*results)
 
     return exprs, trees
 
 class ValuesSampler():
-    def __init__(self, val_range: tuple[int, int]):
+    ENGINES = ('python', 'numpy')
+    STORAGES = ('dict', 'csr')
+
+    def __init__(
+            self,
+            val_range: tuple[int, int],
+            engine: str = 'python',
+            storage: str = 'dict',
+            cache_dir: str = None,
+            cache_key: str = ''
+        ):
+        if engine not in self.ENGINES:
+            raise ValueError(f'Unknown engine: {engine}')
+
+        if storage not in self.STORAGES:
+            raise ValueError(f'Unknown storage: {storage}')
+
         self.val_range = val_range
+        self.engine = engine
+        self.storage = storage
+
+        if cache_dir is None:
+            self.cache = None
+
+            self.mem = MemDict()
+            self.mem_backtrack = MemDict()
+        else:
+            # cached tables are only loaded for the subtrees that are actually used
+            self.cache = TableCache(cache_dir, val_range, key=cache_key)
+
+            self.mem = LazyMemDict(self.cache.__contains__, self.cache.load_values)
+            self.mem_backtrack = LazyMemDict(
+                self.cache.__contains__,
+                lambda tree_hash: self._from_csr(self.cache.load(tree_hash))
+            )
 
-        self.mem = MemDict()
-        self.mem_backtrack = MemDict()
+        # CSR views of dict-stored tables, used by pick_values_batch
+        self.batch_tables = MemDict()
+
+    def _from_csr(self, csr):
+        if self.storage == 'csr':
+            return BacktrackTable(*csr)
+        return csr_to_backtrack(*csr)
     
     def node_constraints(self, n):
         '''
@@ -76,7 +155,41 @@ class ValuesSampler():
         right_possible = self.populate(tree[2], depth + 1)
 
         tree_hash = hash_tree(tree)
-        tree_calcs = self.mem_backtrack[tree_hash] = {}
+
+        start = time.perf_counter()
+
+        if self.engine == 'numpy':
+            csr = calcs_to_csr(*outer_calcs(tree[1], left_possible, right_possible, self.val_range))
+            possible = set(csr[0].tolist())
+        else:
+            possible, tree_calcs = self._combine_python(op, left_possible, right_possible)
+            csr = backtrack_to_csr(tree_calcs) if self.storage == 'csr' or self.cache is not None else None
+
+        if self.storage == 'csr' or self.engine == 'numpy':
+            tree_calcs = self._from_csr(csr)
+
+        self.mem_backtrack[tree_hash] = tree_calcs
+
+        assert len(possible) < (self.val_range[1] - self.val_range[0])
+
+        assert len(possible) > 0
+
+        if self.cache is not None:
+            self.cache.save(tree_hash, csr)
+
+        seconds = time.perf_counter() - start
+        num_pairs = len(csr[2]) if csr is not None else sum(len(pairs) for pairs in tree_calcs.values())
+
+        metrics.observe('populate.table', seconds)
+        metrics.incr('populate.tables')
+        metrics.incr('populate.targets', len(possible))
+        metrics.incr('populate.pairs', num_pairs)
+        metrics.event('populate', op=tree[1], targets=len(possible), pairs=num_pairs, seconds=seconds)
+
+        return possible
+    
+    def _combine_python(self, op, left_possible, right_possible):
+        tree_calcs = {}
 
         possible = set()
         for l in left_possible:
@@ -88,14 +201,10 @@ class ValuesSampler():
                     if calc not in tree_calcs:
                         tree_calcs[calc] = []
 
-                    self.mem_backtrack[tree_hash][calc].append((l, r))
-
-        assert len(possible) < (self.val_range[1] - self.val_range[0])
+                    tree_calcs[calc].append((l, r))
 
-        assert len(possible) > 0
+        return possible, tree_calcs
 
-        return possible
-    
     def pick_values(self, tree, target_val=None, depth=0):
         if target_val is None:
             valid_vals = list(self.mem[hash_tree(tree)])
@@ -117,9 +226,12 @@ class ValuesSampler():
         tree_hash = hash_tree(tree)
         tree_calcs = self.mem_backtrack[tree_hash]
 
-        valid_vals = tree_calcs[target_val]
-        assert len(valid_vals) > 0
-        chosen_path = random.choice(valid_vals)
+        if isinstance(tree_calcs, BacktrackTable):
+            chosen_path = tree_calcs.choice(target_val, random)
+        else:
+            valid_vals = tree_calcs[target_val]
+            assert len(valid_vals) > 0
+            chosen_path = random.choice(valid_vals)
 
         left_val, left_str, left_target = self.pick_values(
             left_tree,
@@ -137,7 +249,85 @@ class ValuesSampler():
 
         return [tree[1], [left_val, right_val]], f"({left_str} {tree[1]} {right_str})", target_val
     
-    def pick_values_dset(self, trees, n_samples=25, pbar=True):
+    def _batch_table(self, tree_hash) -> BacktrackTable:
+        tree_calcs = self.mem_backtrack[tree_hash]
+        if isinstance(tree_calcs, BacktrackTable):
+            return tree_calcs
+
+        if tree_hash not in self.batch_tables:
+            self.batch_tables[tree_hash] = BacktrackTable.from_backtrack(tree_calcs)
+
+        return self.batch_tables[tree_hash]
+
+    def _pick_batch(self, tree, target_vals, leaf_vals):
+        if tree.label() == 'S':
+            return self._pick_batch(tree[0], target_vals, leaf_vals)
+
+        if tree.label() == 'N':
+            leaf_vals.append(target_vals)
+            return
+
+        if tree.label() == 'E': # skip to get to the actual expression
+            return self._pick_batch(tree[1], target_vals, leaf_vals)
+
+        assert len(tree) == 3 # two args and one operator
+        table = self._batch_table(hash_tree(tree))
+
+        idx = np.searchsorted(table.targets, target_vals)
+        assert np.all(table.targets[np.minimum(idx, len(table.targets) - 1)] == target_vals)
+
+        starts = table.offsets[idx]
+        counts = table.offsets[idx + 1] - starts
+        chosen = starts + np.random.randint(0, counts)
+
+        self._pick_batch(tree[0], np.asarray(table.lefts[chosen], dtype=np.int64), leaf_vals)
+        self._pick_batch(tree[2], np.asarray(table.rights[chosen], dtype=np.int64), leaf_vals)
+
+    def pick_values_batch(self, tree, n_samples: int) -> SampleBatch:
+        '''
+        Draw n_samples value assignments for tree in one top-down pass over its structure.
+        Same distribution as calling pick_values n_samples times, but uses np.random.
+        '''
+        self.populate(tree)
+
+        valid_vals = np.array(sorted(self.mem[hash_tree(tree)]), dtype=np.int64)
+        assert len(valid_vals) > 0
+
+        target_vals = valid_vals[np.random.randint(0, len(valid_vals), size=n_samples)]
+
+        leaf_vals = []
+        self._pick_batch(tree, target_vals, leaf_vals)
+
+        shape, fmt = tree_template(tree)
+
+        return SampleBatch(shape, fmt, leaf_vals, target_vals)
+
+    def memory_report(self) -> dict:
+        '''
+        Size of the backtrack tables currently held in memory. For dict storage the
+        byte count is an estimate of the Python object overhead.
+        '''
+        report = {'storage': self.storage, 'subtrees': 0, 'targets': 0, 'pairs': 0, 'bytes': 0}
+
+        for tree_calcs in dict.values(self.mem_backtrack):
+            report['subtrees'] += 1
+            report['targets'] += len(tree_calcs)
+
+            if isinstance(tree_calcs, BacktrackTable):
+                report['pairs'] += tree_calcs.num_pairs()
+                report['bytes'] += tree_calcs.nbytes()
+            else:
+                report['bytes'] += sys.getsizeof(tree_calcs)
+                for pairs in tree_calcs.values():
+                    report['pairs'] += len(pairs)
+                    report['bytes'] += sys.getsizeof(pairs) + sum(
+                        sys.getsizeof(pair) + sys.getsizeof(pair[0]) + sys.getsizeof(pair[1])
+                        for pair in pairs
+                    )
+
+        return report
+
+    def pick_values_dset(self, trees, n_samples=25, pbar=True, batch=False):
         iterator_mem = tqdm(trees, desc='Populating mem values') if pbar else trees
         # populat mem
         for tree_lst in iterator_mem:
@@ -154,6 +344,10 @@ class ValuesSampler():
             assert len(tree_lst) == 1
             tree = tree_lst[0]
 
+            if batch:
+                results_vals.append(self.pick_values_batch(tree, n_samples).as_tuples())
+                continue
+
             tree_samples = []
 
             for _ in range(n_samples):
@@ -1,10 +1,31 @@
 import random
 
+from ..metrics import metrics
+
 
 class MemDict(dict):
     def reset(self):
         self.clear()
 
+class LazyMemDict(MemDict):
+    '''
+    MemDict that falls back to loading missing keys from a backing store.
+    '''
+    def __init__(self, exists, loader):
+        super().__init__()
+        self.exists = exists
+        self.loader = loader
+
+    def __contains__(self, key):
+        return super().__contains__(key) or self.exists(key)
+
+    def __missing__(self, key):
+        if not self.exists(key):
+            raise KeyError(key)
+
+        value = self[key] = self.loader(key)
+        return value
+
 def hash_tree(tree):
     return tuple(tree.leaves())
 
@@ -15,8 +36,11 @@ def add_mem(f):
         hash_val = hash_tree(tree)
 
         if hash_val in self.mem:
+            metrics.incr('mem.hits')
             return self.mem[hash_val]
 
+        metrics.incr('mem.misses')
+
         result = f(self, tree, depth=depth)
         self.mem[hash_val] = result
         return result
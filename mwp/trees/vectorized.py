@@ -0,0 +1,42 @@
+import numpy as np
+
+
+np_op_map = {
+    '*': np.multiply,
+    '+': np.add,
+    '-': np.subtract,
+}
+
+
+def outer_calcs(op: str, left_possible, right_possible, val_range: tuple[int, int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    Apply op to every (left, right) pair and keep the results that are integers in val_range.
+    Returns (calcs, lefts, rights), sorted by calc, then left, then right.
+    '''
+    left = np.array(sorted(left_possible), dtype=np.int64)
+    right = np.array(sorted(right_possible), dtype=np.int64)
+
+    l = left[:, None]
+    r = right[None, :]
+
+    if op == '/':
+        nonzero = r != 0
+        safe_r = np.where(nonzero, r, 1)
+        valid = nonzero & (l % safe_r == 0)
+        calc = l // safe_r
+    elif op in np_op_map:
+        calc = np_op_map[op](l, r)
+        valid = np.ones(calc.shape, dtype=bool)
+    else:
+        raise ValueError(f'Unknown operation: {op}')
+
+    valid &= (calc >= val_range[0]) & (calc < val_range[1])
+
+    # nonzero is row-major, so pairs come out ordered by (left, right)
+    left_idx, right_idx = np.nonzero(valid)
+    calcs = calc[left_idx, right_idx]
+
+    order = np.argsort(calcs, kind='stable')
+
+    return calcs[order], left[left_idx[order]], right[right_idx[order]]
+